@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import argparse
+import numpy as np
+import tritonclient.http as httpclient
+
+from mock_triton_server import MockTritonServer
+
+
+MODEL_NAME_DEFAULT = 'densenet_onnx'
+REPEAT_DEFAULT = 10000
+
+
+def fetch_response(client, model_name, binary_data):
+    metadata = client.get_model_metadata(model_name)
+    input_metadata = metadata['inputs'][0]
+    output_name = metadata['outputs'][0]['name']
+    shape = [1 if dim < 0 else dim for dim in input_metadata['shape']]
+
+    infer_input = httpclient.InferInput(
+        input_metadata['name'], shape, input_metadata['datatype'])
+    infer_input.set_data_from_numpy(np.zeros(shape, dtype=np.float32))
+    output = httpclient.InferRequestedOutput(output_name, binary_data=binary_data)
+    return client.infer(model_name, [infer_input], outputs=[output]), output_name
+
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    # Parse the command line parameters
+    parser = argparse.ArgumentParser(description='Triton Output Decode Benchmark')
+    parser.add_argument('--model',
+        type=str, default=MODEL_NAME_DEFAULT, metavar='MODEL_NAME',
+        help='Model Name (Default: {})'.format(MODEL_NAME_DEFAULT))
+    parser.add_argument('--repeat',
+        type=int, default=REPEAT_DEFAULT, metavar='REPEAT',
+        help='Decodes per Method (Default: {})'.format(REPEAT_DEFAULT))
+    parser.add_argument('--url',
+        type=str, default=None, metavar='SERVER_URL',
+        help='HTTP URL of a running server (Default: local mock server)')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = MockTritonServer(http_port=0, grpc_port=None)
+        server.start()
+        url = 'localhost:{}'.format(server.http_port)
+
+    client = httpclient.InferenceServerClient(url=url)
+    json_response, name = fetch_response(client, args.model, binary_data=False)
+    binary_response, _ = fetch_response(client, args.model, binary_data=True)
+    client.close()
+    if server is not None:
+        server.stop()
+
+    methods = [
+        ('json as_numpy', lambda: json_response.as_numpy(name)),
+        ('binary as_numpy', lambda: binary_response.as_numpy(name)),
+    ]
+    shape = binary_response.as_numpy(name).shape
+    print('{} output {} {}'.format(args.model, name, shape))
+    print('{:>18} {:>12}'.format('method', 'decode[us]'))
+    for label, func in methods:
+        print('{:>18} {:>12.2f}'.format(label, measure(func, args.repeat) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,517 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+import json
+import struct
+import time
+import argparse
+import threading
+from concurrent import futures
+from multiprocessing import shared_memory
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+import numpy as np
+from google.protobuf.json_format import ParseDict
+from tritonclient.grpc import service_pb2, service_pb2_grpc
+from tritonclient.utils import np_to_triton_dtype
+
+
+HTTP_PORT_DEFAULT = 8000
+GRPC_PORT_DEFAULT = 8001
+LATENCY_DEFAULT = 0.0
+JITTER_DEFAULT = 0.0
+SEED = 0
+
+
+def _raw_contents(output):
+    # BYTES elements are serialized with a 4-byte length prefix each
+    if output.dtype == np.object_:
+        return b''.join(
+            struct.pack('<I', len(element)) + element for element in output.flatten())
+    return output.tobytes()
+
+
+def _yolo_grid(rng, anchors, classes, size, detections):
+    # Mostly background cells, with a few confident detections
+    grid = rng.normal(0.0, 1.0, (anchors * (5 + classes), size, size)).astype(np.float32)
+    objectness = grid.reshape(anchors, 5 + classes, size, size)[:, 4]
+    objectness[...] = -6.0
+    for _ in range(detections):
+        anchor, row, col = rng.integers(0, anchors), rng.integers(0, size), rng.integers(0, size)
+        objectness[anchor, row, col] = 4.0
+    return grid
+
+
+def _tiny_yolov2_output(rng):
+    return [_yolo_grid(rng, 5, 20, 13, 4)]
+
+
+def _yolov3_output(rng):
+    # One head per scale, as PostprocessYOLO.masks
+    return [_yolo_grid(rng, 3, 80, size, 2) for size in (13, 26, 52)]
+
+
+def _densenet_output(rng):
+    return [rng.normal(0.0, 1.0, (1000,)).astype(np.float32)]
+
+
+# Signatures of the models of this repository, as the server reports them
+MODELS = {
+    'tinyyolov2_onnx': {
+        'platform': 'onnxruntime_onnx',
+        'max_batch_size': 128,
+        'inputs': [('image', 'FP32', 'FORMAT_NCHW', [3, 416, 416])],
+        'outputs': [('grid', 'FP32', [125, 13, 13])],
+        'canned_output': _tiny_yolov2_output,
+    },
+    'yolov3_onnx': {
+        'platform': 'onnxruntime_onnx',
+        'max_batch_size': 32,
+        'inputs': [('000_net', 'FP32', 'FORMAT_NCHW', [3, 416, 416])],
+        'outputs': [
+            ('082_convolutional', 'FP32', [255, 13, 13]),
+            ('094_convolutional', 'FP32', [255, 26, 26]),
+            ('106_convolutional', 'FP32', [255, 52, 52]),
+        ],
+        'canned_output': _yolov3_output,
+    },
+    'densenet_onnx': {
+        'platform': 'onnxruntime_onnx',
+        'max_batch_size': 0,
+        'inputs': [('data_0', 'FP32', 'FORMAT_NCHW', [3, 224, 224])],
+        'outputs': [('fc6_1', 'FP32', [1000])],
+        'canned_output': _densenet_output,
+    },
+}
+
+
+class MockModel():
+    '''A model of the mock server returning a canned output tensor.
+
+    Attributes:
+        name: Model name.
+        spec: Model signature from MODELS.
+        outputs: Canned outputs of a single sample by name.
+        output_names: Names of the outputs in the order of the signature.
+    '''
+
+    def __init__(self, name, spec, rng):
+        self.name = name
+        self.spec = spec
+        self.output_names = [output[0] for output in spec['outputs']]
+        self.outputs = dict(zip(self.output_names, spec['canned_output'](rng)))
+
+    def metadata(self):
+        batch = [-1] if self.spec['max_batch_size'] > 0 else []
+        return {
+            'name': self.name,
+            'versions': ['1'],
+            'platform': self.spec['platform'],
+            'inputs': [
+                {'name': name, 'datatype': dtype, 'shape': batch + dims}
+                for name, dtype, _, dims in self.spec['inputs']
+            ],
+            'outputs': [
+                {'name': name, 'datatype': dtype, 'shape': batch + dims}
+                for name, dtype, dims in self.spec['outputs']
+            ],
+        }
+
+    def config(self):
+        return {
+            'name': self.name,
+            'platform': self.spec['platform'],
+            'max_batch_size': self.spec['max_batch_size'],
+            'input': [{
+                'name': name, 'data_type': 'TYPE_' + dtype,
+                'format': format, 'dims': dims,
+            } for name, dtype, format, dims in self.spec['inputs']],
+            'output': [{
+                'name': name, 'data_type': 'TYPE_' + dtype,
+                'dims': dims,
+            } for name, dtype, dims in self.spec['outputs']],
+        }
+
+    def infer(self, input_shape, name, class_count):
+        '''Return an output array for a request.
+
+        Args:
+            input_shape: Shape of the first request input, to find the batch size.
+            name(str): Output name.
+            class_count(int): Number of classes requested, 0 for the raw tensor.
+        '''
+        output = self.outputs[name]
+        if class_count > 0:
+            top = np.argsort(-output, axis=None)[:class_count]
+            flat = output.flatten()
+            output = np.array(
+                ['{:f}:{}:class_{}'.format(flat[i], i, i).encode() for i in top],
+                dtype=np.object_)
+        if self.spec['max_batch_size'] > 0:
+            output = np.repeat(output[np.newaxis], input_shape[0], axis=0)
+        return output
+
+
+class MockTritonServer():
+    '''A local stand-in for Triton Inference Server.
+
+    It serves the HTTP/REST and gRPC endpoints used by TritonClient for the
+    models in MODELS, and answers every inference request with a canned
+    output after a configurable latency. It is meant for benchmarks and CI
+    runs without a GPU or a real server.
+
+    Attributes:
+        models: Served models by name.
+        latency: Delay added to every inference request in seconds.
+        jitter: Maximum random delay added on top of latency in seconds.
+        request_count: Number of inference requests served.
+    '''
+
+    def __init__(self, http_port=HTTP_PORT_DEFAULT, grpc_port=GRPC_PORT_DEFAULT,
+                 latency=LATENCY_DEFAULT, seed=SEED, jitter=JITTER_DEFAULT):
+        '''
+        Args:
+            http_port(int): HTTP port, None to disable HTTP.
+            grpc_port(int): gRPC port, None to disable gRPC.
+            latency(float): Delay added to every inference request in seconds.
+            seed(int): Seed of the canned outputs and of the jitter.
+            jitter(float): Maximum random delay added on top of latency,
+                drawn uniformly in the same sequence for the same seed.
+        '''
+        rng = np.random.default_rng(seed)
+        self.models = {name: MockModel(name, spec, rng) for name, spec in MODELS.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.jitter_rng = np.random.default_rng(seed)
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.http_port = http_port
+        self.grpc_port = grpc_port
+        self.http_server = None
+        self.grpc_server = None
+        # Registered system shared memory regions: name -> (memory, offset, byte_size)
+        self.shm_regions = {}
+
+    def start(self):
+        if self.http_port is not None:
+            handler = type('Handler', (_HttpHandler,), {'mock': self})
+            self.http_server = ThreadingHTTPServer(('localhost', self.http_port), handler)
+            self.http_server.daemon_threads = True
+            self.http_port = self.http_server.server_address[1]
+            threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        if self.grpc_port is not None:
+            # No message size limit, as Triton, for batched requests
+            self.grpc_server = grpc.server(
+                futures.ThreadPoolExecutor(max_workers=16),
+                options=[('grpc.max_receive_message_length', -1),
+                         ('grpc.max_send_message_length', -1)])
+            service_pb2_grpc.add_GRPCInferenceServiceServicer_to_server(
+                _GrpcServicer(self), self.grpc_server)
+            self.grpc_port = self.grpc_server.add_insecure_port(
+                'localhost:{}'.format(self.grpc_port))
+            self.grpc_server.start()
+
+    def stop(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+        if self.grpc_server is not None:
+            self.grpc_server.stop(None)
+        self.unregister_shared_memory()
+
+    def register_shared_memory(self, name, key, offset, byte_size):
+        memory = shared_memory.SharedMemory(key)
+        with self.lock:
+            self.shm_regions[name] = (memory, offset, byte_size)
+
+    def unregister_shared_memory(self, name=''):
+        with self.lock:
+            names = [name] if name else list(self.shm_regions)
+            for region in names:
+                entry = self.shm_regions.pop(region, None)
+                if entry is not None:
+                    entry[0].close()
+
+    def write_shared_memory(self, name, offset, raw):
+        memory, region_offset, byte_size = self.shm_regions[name]
+        if len(raw) > byte_size - offset:
+            raise ValueError('output does not fit in region {}'.format(name))
+        start = region_offset + offset
+        memory.buf[start:start + len(raw)] = raw
+
+    def infer(self, model_name, input_shape, outputs):
+        '''Return the (name, array) of the outputs of a request, in the
+        order of outputs, (name, class_count) pairs, or all the outputs
+        of the model if it is empty.
+        '''
+        latency = self.latency
+        with self.lock:
+            self.request_count += 1
+            if self.jitter > 0:
+                latency += self.jitter_rng.uniform(0.0, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+        model = self.models[model_name]
+        if not outputs:
+            outputs = [(name, 0) for name in model.output_names]
+        return [(name, model.infer(input_shape, name, class_count))
+                for name, class_count in outputs]
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one write, without waiting for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    mock = None
+
+    MODEL_PATH = re.compile(r'^/v2/models/([^/]+)(?:/versions/[^/]+)?(/ready|/config|/infer)?$')
+    LOAD_PATH = re.compile(r'^/v2/repository/models/([^/]+)/(load|unload)$')
+    SHM_PATH = re.compile(
+        r'^/v2/systemsharedmemory(?:/region/([^/]+))?/(register|unregister)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_json(self, obj):
+        self._reply(200, json.dumps(obj).encode(), {'Content-Type': 'application/json'})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        if self.path in ('/v2/health/ready', '/v2/health/live'):
+            return self._reply(200)
+        match = self.MODEL_PATH.match(self.path)
+        if match is None or match.group(1) not in self.mock.models:
+            return self._reply(404)
+        model = self.mock.models[match.group(1)]
+        if match.group(2) == '/ready':
+            return self._reply(200)
+        if match.group(2) == '/config':
+            return self._reply_json(model.config())
+        if match.group(2) is None:
+            return self._reply_json(model.metadata())
+        return self._reply(404)
+
+    def do_POST(self):
+        body = self._read_body()
+        match = self.LOAD_PATH.match(self.path)
+        if match is not None:
+            return self._reply(200 if match.group(1) in self.mock.models else 400)
+        match = self.SHM_PATH.match(self.path)
+        if match is not None:
+            if match.group(2) == 'register':
+                request = json.loads(body)
+                self.mock.register_shared_memory(
+                    match.group(1), request['key'], request.get('offset', 0),
+                    request['byte_size'])
+            else:
+                self.mock.unregister_shared_memory(match.group(1) or '')
+            return self._reply(200)
+        match = self.MODEL_PATH.match(self.path)
+        if match is None or match.group(2) != '/infer' or \
+                match.group(1) not in self.mock.models:
+            return self._reply(404)
+
+        header_length = self.headers.get('Inference-Header-Content-Length')
+        header = json.loads(body[:int(header_length)] if header_length else body)
+        input_shape = header['inputs'][0]['shape']
+        requested = []
+        parameters = {}
+        for output in header.get('outputs', []):
+            parameters[output['name']] = output.get('parameters', {})
+            requested.append(
+                (output['name'], parameters[output['name']].get('classification', 0)))
+
+        model = self.mock.models[match.group(1)]
+        response = {'model_name': model.name, 'model_version': '1', 'outputs': []}
+        if 'id' in header:
+            response['id'] = header['id']
+        raw_outputs = []
+        for name, output in self.mock.infer(model.name, input_shape, requested):
+            output_json = {
+                'name': name,
+                'datatype': np_to_triton_dtype(output.dtype),
+                'shape': list(output.shape),
+            }
+            response['outputs'].append(output_json)
+            output_parameters = parameters.get(name, {})
+            shm_region = output_parameters.get('shared_memory_region')
+            if shm_region is not None:
+                self.mock.write_shared_memory(
+                    shm_region, output_parameters.get('shared_memory_offset', 0),
+                    _raw_contents(output))
+                output_json['parameters'] = {'shared_memory_region': shm_region}
+            elif not output_parameters.get('binary_data', True):
+                if output.dtype == np.object_:
+                    output_json['data'] = [x.decode() for x in output.flatten()]
+                else:
+                    output_json['data'] = output.flatten().tolist()
+            else:
+                raw = _raw_contents(output)
+                output_json['parameters'] = {'binary_data_size': len(raw)}
+                raw_outputs.append(raw)
+
+        if not raw_outputs:
+            return self._reply_json(response)
+        response_json = json.dumps(response).encode()
+        self._reply(200, b''.join([response_json] + raw_outputs), {
+            'Content-Type': 'application/octet-stream',
+            'Inference-Header-Content-Length': str(len(response_json)),
+        })
+
+
+class _GrpcServicer(service_pb2_grpc.GRPCInferenceServiceServicer):
+
+    def __init__(self, mock):
+        self.mock = mock
+
+    def _model(self, name, context):
+        model = self.mock.models.get(name)
+        if model is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'unknown model {}'.format(name))
+        return model
+
+    def ServerLive(self, request, context):
+        return service_pb2.ServerLiveResponse(live=True)
+
+    def ServerReady(self, request, context):
+        return service_pb2.ServerReadyResponse(ready=True)
+
+    def ModelReady(self, request, context):
+        return service_pb2.ModelReadyResponse(ready=request.name in self.mock.models)
+
+    def RepositoryModelLoad(self, request, context):
+        self._model(request.model_name, context)
+        return service_pb2.RepositoryModelLoadResponse()
+
+    def RepositoryModelUnload(self, request, context):
+        return service_pb2.RepositoryModelUnloadResponse()
+
+    def SystemSharedMemoryRegister(self, request, context):
+        self.mock.register_shared_memory(
+            request.name, request.key, request.offset, request.byte_size)
+        return service_pb2.SystemSharedMemoryRegisterResponse()
+
+    def SystemSharedMemoryUnregister(self, request, context):
+        self.mock.unregister_shared_memory(request.name)
+        return service_pb2.SystemSharedMemoryUnregisterResponse()
+
+    def ModelMetadata(self, request, context):
+        metadata = self._model(request.name, context).metadata()
+        response = service_pb2.ModelMetadataResponse(
+            name=metadata['name'], versions=metadata['versions'],
+            platform=metadata['platform'])
+        for key, tensors in (('inputs', response.inputs), ('outputs', response.outputs)):
+            for tensor in metadata[key]:
+                tensors.add(
+                    name=tensor['name'], datatype=tensor['datatype'], shape=tensor['shape'])
+        return response
+
+    def ModelConfig(self, request, context):
+        config = self._model(request.name, context).config()
+        response = service_pb2.ModelConfigResponse()
+        ParseDict(config, response.config)
+        return response
+
+    def _infer(self, request, context):
+        model = self._model(request.model_name, context)
+        requested = []
+        parameters = {}
+        for output in request.outputs:
+            parameters[output.name] = output.parameters
+            class_count = 0
+            if 'classification' in output.parameters:
+                class_count = output.parameters['classification'].int64_param
+            requested.append((output.name, class_count))
+
+        response = service_pb2.ModelInferResponse(
+            model_name=model.name, model_version='1', id=request.id)
+        for name, output in self.mock.infer(
+                model.name, list(request.inputs[0].shape), requested):
+            tensor = response.outputs.add(
+                name=name, datatype=np_to_triton_dtype(output.dtype), shape=output.shape)
+            output_parameters = parameters.get(name, {})
+            if 'shared_memory_region' in output_parameters:
+                shm_region = output_parameters['shared_memory_region'].string_param
+                self.mock.write_shared_memory(
+                    shm_region, output_parameters['shared_memory_offset'].int64_param,
+                    _raw_contents(output))
+                tensor.parameters['shared_memory_region'].string_param = shm_region
+            else:
+                response.raw_output_contents.append(_raw_contents(output))
+        return response
+
+    def ModelInfer(self, request, context):
+        return self._infer(request, context)
+
+    def ModelStreamInfer(self, request_iterator, context):
+        for request in request_iterator:
+            yield service_pb2.ModelStreamInferResponse(
+                infer_response=self._infer(request, context))
+
+
+def main():
+    # Parse the command line parameters
+    parser = argparse.ArgumentParser(description='Mock Triton Inference Server')
+    parser.add_argument('--http-port',
+        type=int, default=HTTP_PORT_DEFAULT, metavar='HTTP_PORT',
+        help='HTTP Port (Default: {})'.format(HTTP_PORT_DEFAULT))
+    parser.add_argument('--grpc-port',
+        type=int, default=GRPC_PORT_DEFAULT, metavar='GRPC_PORT',
+        help='gRPC Port (Default: {})'.format(GRPC_PORT_DEFAULT))
+    parser.add_argument('--latency',
+        type=float, default=LATENCY_DEFAULT, metavar='LATENCY',
+        help='Inference Latency in Seconds (Default: {})'.format(LATENCY_DEFAULT))
+    parser.add_argument('--jitter',
+        type=float, default=JITTER_DEFAULT, metavar='JITTER',
+        help='Maximum Random Latency added in Seconds (Default: {})'.format(JITTER_DEFAULT))
+    args = parser.parse_args()
+
+    server = MockTritonServer(
+        args.http_port, args.grpc_port, args.latency, jitter=args.jitter)
+    server.start()
+    print('Serving {} on HTTP port {} and gRPC port {}'.format(
+        ', '.join(server.models), server.http_port, server.grpc_port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
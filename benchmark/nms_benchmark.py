@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'tiny_yolov2'))
+from nms import nms
+
+
+BOX_COUNTS_DEFAULT = [10, 100, 1000, 10000]
+NUM_CATEGORIES_DEFAULT = 20
+NMS_THRESHOLD_DEFAULT = 0.3
+REPEAT_DEFAULT = 10
+SEED = 0
+
+
+def make_candidates(rng, count, num_categories, width=640, height=480):
+    xy = rng.uniform(0, (width, height), (count, 2))
+    wh = rng.uniform(16, 160, (count, 2))
+    boxes = np.concatenate((xy, wh), axis=-1).astype(np.float32)
+    scores = rng.uniform(0.5, 1.0, count).astype(np.float32)
+    categories = rng.integers(0, num_categories, count)
+    return boxes, scores, categories
+
+
+def nms_boxes_reference(boxes, box_confidences, nms_threshold):
+    # The former PostprocessYOLO._nms_boxes, kept here as the reference
+    x_coord = boxes[:, 0]
+    y_coord = boxes[:, 1]
+    width = boxes[:, 2]
+    height = boxes[:, 3]
+
+    areas = width * height
+    ordered = box_confidences.argsort()[::-1]
+
+    keep = list()
+    while ordered.size > 0:
+        i = ordered[0]
+        keep.append(i)
+        xx1 = np.maximum(x_coord[i], x_coord[ordered[1:]])
+        yy1 = np.maximum(y_coord[i], y_coord[ordered[1:]])
+        xx2 = np.minimum(x_coord[i] + width[i], x_coord[ordered[1:]] + width[ordered[1:]])
+        yy2 = np.minimum(y_coord[i] + height[i], y_coord[ordered[1:]] + height[ordered[1:]])
+
+        width1 = np.maximum(0.0, xx2 - xx1 + 1)
+        height1 = np.maximum(0.0, yy2 - yy1 + 1)
+        intersection = width1 * height1
+        union = (areas[i] + areas[ordered[1:]] - intersection)
+        iou = intersection / union
+        indexes = np.where(iou <= nms_threshold)[0]
+        ordered = ordered[indexes + 1]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def nms_reference(boxes, scores, categories, nms_threshold):
+    # The former per-category loop of PostprocessYOLO._process_yolo_output
+    keep = list()
+    for category in set(categories):
+        idxs = np.where(categories == category)[0]
+        keep.append(idxs[nms_boxes_reference(boxes[idxs], scores[idxs], nms_threshold)])
+    return np.concatenate(keep)
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def main():
+    # Parse the command line parameters
+    parser = argparse.ArgumentParser(description='NMS Benchmark')
+    parser.add_argument('--counts',
+        type=int, nargs='+', default=BOX_COUNTS_DEFAULT, metavar='BOX_COUNT',
+        help='Candidate box counts (Default: {})'.format(BOX_COUNTS_DEFAULT))
+    parser.add_argument('--categories',
+        type=int, default=NUM_CATEGORIES_DEFAULT, metavar='NUM_CATEGORIES',
+        help='Number of categories (Default: {})'.format(NUM_CATEGORIES_DEFAULT))
+    parser.add_argument('--repeat',
+        type=int, default=REPEAT_DEFAULT, metavar='REPEAT',
+        help='Repetitions per count (Default: {})'.format(REPEAT_DEFAULT))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(SEED)
+    failures = 0
+    print('{:>8} {:>8} {:>12} {:>12} {:>12}'.format(
+        'boxes', 'kept', 'former[ms]', 'nms[ms]', 'top10[ms]'))
+    for count in args.counts:
+        boxes, scores, categories = make_candidates(rng, count, args.categories)
+        keep = nms(boxes, scores, categories, NMS_THRESHOLD_DEFAULT)
+        reference = nms_reference(boxes, scores, categories, NMS_THRESHOLD_DEFAULT)
+        ok = np.array_equal(np.sort(keep), np.sort(reference))
+        failures += not ok
+        former_time = measure(
+            lambda: nms_reference(boxes, scores, categories, NMS_THRESHOLD_DEFAULT),
+            args.repeat)
+        all_time = measure(
+            lambda: nms(boxes, scores, categories, NMS_THRESHOLD_DEFAULT),
+            args.repeat)
+        top_time = measure(
+            lambda: nms(boxes, scores, categories, NMS_THRESHOLD_DEFAULT, top_k=10),
+            args.repeat)
+        print('{:>8} {:>8} {:>12.3f} {:>12.3f} {:>12.3f}{}'.format(
+            count, len(keep), former_time * 1000, all_time * 1000, top_time * 1000,
+            '' if ok else '  FAILED'))
+
+    if failures:
+        print('{} counts keep other boxes than the former per-category NMS'.format(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
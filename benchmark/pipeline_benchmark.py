@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import collections
+import importlib.util
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'tiny_yolov2'))
+import triton_client
+from data_processing import PostprocessYOLO
+from mock_triton_server import MockTritonServer
+
+
+MODELS = ['tinyyolov2_onnx', 'densenet_onnx']
+FRAMES_DEFAULT = 200
+WARMUP_FRAMES = 10
+SYNTHETIC_FRAMES = 8
+CAPTURE_WIDTH_DEFAULT = 640
+CAPTURE_HEIGHT_DEFAULT = 480
+PREPROCESS_BACKENDS = ['pil', 'opencv']
+PREPROCESS_BACKEND_DEFAULT = 'pil'
+PROTOCOLS = ['http', 'grpc']
+PROTOCOL_DEFAULT = 'http'
+MAX_INFLIGHT_DEFAULT = 1
+LATENCY_DEFAULT = 0.005
+JITTER_DEFAULT = 0.0
+CLASS_COUNT = 3
+STAGES = ['preprocess', 'submit', 'wait', 'postprocess', 'total']
+PERCENTILES = [50, 95, 99]
+# Total latency percentiles compared with a baseline, with the throughput
+BASELINE_PERCENTILES = [50, 99]
+TOLERANCE_DEFAULT = 10.0
+SEED = 0
+
+
+def load_module(name, path):
+    '''Load a module by path, as both demos have a preprocess module.'''
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(os.path.dirname(__file__), '..', path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_frames(count, width, height):
+    # Noise with a few solid boxes, the same for every run
+    rng = np.random.default_rng(SEED)
+    frames = []
+    for _ in range(count):
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        for _ in range(4):
+            x, y = rng.integers(0, width - 64), rng.integers(0, height - 64)
+            frame[y:y + 64, x:x + 64] = rng.integers(0, 256, 3, dtype=np.uint8)
+        frames.append(frame)
+    return frames
+
+
+def recorded_frames(path, count):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        print('Cannot open {}'.format(path))
+        sys.exit(-1)
+    frames = []
+    while len(frames) < count:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def parse_classes(output_array):
+    # The "score:index:label" strings of the classification demo
+    results = []
+    for result in output_array.reshape(-1):
+        if isinstance(result, bytes):
+            result = result.decode('utf-8', 'replace')
+        score, index, label = result.split(':', 2)
+        results.append((float(score), int(index), label))
+    return results
+
+
+def make_stages(model_name, client, backend):
+    '''Return the preprocess and postprocess functions of the demo of a
+    model, and its class count.
+    '''
+    if model_name == 'tinyyolov2_onnx':
+        preprocess = load_module('tiny_yolov2_preprocess', 'tiny_yolov2/preprocess.py')
+        postprocessor = PostprocessYOLO(
+            yolo_masks=[(0, 1, 2, 3, 4)],
+            yolo_anchors=[(1.08, 1.19), (3.42, 4.41), (6.63, 11.38), (9.42, 5.11), (16.62, 10.52)],
+            obj_threshold=0.5, nms_threshold=0.3,
+            yolo_input_resolution=(416, 416), num_categories=20)
+
+        def preprocess_frame(frame):
+            if backend == 'opencv':
+                return preprocess.preprocess_opencv(
+                    frame, client.format, client.dtype, client.c, client.h, client.w)
+            return preprocess.preprocess(
+                frame, client.format, client.dtype, client.c, client.h, client.w)
+
+        def postprocess_frame(frame, output):
+            height, width, _ = frame.shape
+            return postprocessor.process([output], (width, height))
+
+        return preprocess_frame, postprocess_frame, 0
+
+    preprocess = load_module('densenet_preprocess', 'densenet_classification/preprocess.py')
+
+    def preprocess_frame(frame):
+        if backend == 'opencv':
+            return preprocess.preprocess_opencv(
+                frame, client.format, client.dtype,
+                client.c, client.h, client.w, 'INCEPTION')
+        return preprocess.preprocess(
+            frame, client.format, client.dtype,
+            client.c, client.h, client.w, 'INCEPTION')
+
+    def postprocess_frame(frame, output):
+        return parse_classes(output)
+
+    return preprocess_frame, postprocess_frame, CLASS_COUNT
+
+
+def run_frames(client, stages, frames, count):
+    '''Run count frames through the stages as the demos do, with up to
+    max_inflight requests in flight, and return the time of every stage
+    of every frame and the throughput.
+    '''
+    preprocess_frame, postprocess_frame, class_count = stages
+    times = {stage: [] for stage in STAGES}
+    # Frames submitted, with the start of their processing, oldest first
+    pending = collections.deque()
+
+    def collect(drain):
+        start = time.perf_counter()
+        output = client.get_results(drain=drain)
+        times['wait'].append(time.perf_counter() - start)
+        if output is None:
+            return
+        frame, frame_start = pending.popleft()
+        start = time.perf_counter()
+        postprocess_frame(frame, output)
+        end = time.perf_counter()
+        times['postprocess'].append(end - start)
+        times['total'].append(end - frame_start)
+
+    run_start = time.perf_counter()
+    for i in range(count):
+        frame = frames[i % len(frames)]
+        start = time.perf_counter()
+        image = preprocess_frame(frame)
+        submit = time.perf_counter()
+        client.infer(image, class_count=class_count)
+        times['preprocess'].append(submit - start)
+        times['submit'].append(time.perf_counter() - submit)
+        pending.append((frame, start))
+        collect(False)
+    while pending:
+        collect(True)
+    elapsed = time.perf_counter() - run_start
+
+    return {stage: np.array(values) for stage, values in times.items()}, count / elapsed
+
+
+def summarize(times, fps):
+    summary = {'fps': fps}
+    for stage in STAGES:
+        values = times[stage] * 1000
+        summary[stage] = {'mean': values.mean()}
+        for percentile in PERCENTILES:
+            summary[stage]['p{}'.format(percentile)] = np.percentile(values, percentile)
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    '''Print the throughput and total latency of each model against a
+    baseline of --json, and return the number of regressions beyond
+    tolerance percent.
+    '''
+    regressions = 0
+    print()
+    print('{:>16} {:>14} {:>10} {:>10} {:>8}'.format(
+        'model', 'metric', 'baseline', 'current', 'change'))
+    for model_name, summary in results.items():
+        if model_name not in baseline:
+            print('{:>16} not in the baseline'.format(model_name))
+            continue
+        # (name, baseline, current, True if higher is better)
+        metrics = [('fps', baseline[model_name]['fps'], summary['fps'], True)]
+        for percentile in BASELINE_PERCENTILES:
+            key = 'p{}'.format(percentile)
+            metrics.append(('total {}[ms]'.format(key),
+                            baseline[model_name]['total'][key],
+                            summary['total'][key], False))
+        for name, reference, value, higher_is_better in metrics:
+            change = (value - reference) / reference * 100 if reference else 0.0
+            regressed = -change > tolerance if higher_is_better else change > tolerance
+            regressions += regressed
+            print('{:>16} {:>14} {:>10.2f} {:>10.2f} {:>+7.1f}%{}'.format(
+                model_name, name, reference, value, change,
+                '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    # Parse the command line parameters
+    parser = argparse.ArgumentParser(description='Triton Pipeline Benchmark')
+    parser.add_argument('--models',
+        type=str, nargs='+', default=MODELS, choices=MODELS, metavar='MODEL_NAME',
+        help='Models of the demos to run {} (Default: all)'.format(MODELS))
+    parser.add_argument('--frames',
+        type=int, default=FRAMES_DEFAULT, metavar='FRAMES',
+        help='Frames per Model (Default: {})'.format(FRAMES_DEFAULT))
+    parser.add_argument('--source',
+        type=str, default=None, metavar='VIDEO_FILE',
+        help='Recorded frames to use, cycled if shorter (Default: synthetic frames)')
+    parser.add_argument('--width',
+        type=int, default=CAPTURE_WIDTH_DEFAULT, metavar='CAPTURE_WIDTH',
+        help='Synthetic Frame Width (Default: {})'.format(CAPTURE_WIDTH_DEFAULT))
+    parser.add_argument('--height',
+        type=int, default=CAPTURE_HEIGHT_DEFAULT, metavar='CAPTURE_HEIGHT',
+        help='Synthetic Frame Height (Default: {})'.format(CAPTURE_HEIGHT_DEFAULT))
+    parser.add_argument('--preprocess',
+        type=str, default=PREPROCESS_BACKEND_DEFAULT, choices=PREPROCESS_BACKENDS,
+        metavar='BACKEND',
+        help='Preprocessing backend {} (Default: {})'.format(
+            PREPROCESS_BACKENDS, PREPROCESS_BACKEND_DEFAULT))
+    parser.add_argument('--protocol',
+        type=str, default=PROTOCOL_DEFAULT, choices=PROTOCOLS, metavar='PROTOCOL',
+        help='Protocol {} (Default: {})'.format(PROTOCOLS, PROTOCOL_DEFAULT))
+    parser.add_argument('--inflight',
+        type=int, default=MAX_INFLIGHT_DEFAULT, metavar='MAX_INFLIGHT',
+        help='Max Inference Requests in Flight (Default: {})'.format(MAX_INFLIGHT_DEFAULT))
+    parser.add_argument('--latency',
+        type=float, default=LATENCY_DEFAULT, metavar='LATENCY',
+        help='Inference Latency of the mock server in Seconds (Default: {})'.format(LATENCY_DEFAULT))
+    parser.add_argument('--jitter',
+        type=float, default=JITTER_DEFAULT, metavar='JITTER',
+        help='Maximum Random Latency added by the mock server in Seconds (Default: {})'.format(JITTER_DEFAULT))
+    parser.add_argument('--url',
+        type=str, default=None, metavar='SERVER_URL',
+        help='URL of a running server (Default: local mock server)')
+    parser.add_argument('--json',
+        type=str, default=None, metavar='JSON_FILE',
+        help='Also write the results to a JSON file, to compare runs')
+    parser.add_argument('--baseline',
+        type=str, default=None, metavar='JSON_FILE',
+        help='Results of --json to compare with, exit with 1 on a regression')
+    parser.add_argument('--tolerance',
+        type=float, default=TOLERANCE_DEFAULT, metavar='PCT',
+        help='Change from the baseline allowed in percent (Default: {})'.format(TOLERANCE_DEFAULT))
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        # Read before the run, not to find a missing file only at the end
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    server = None
+    url = args.url
+    if url is None:
+        # Let the OS pick a free port
+        server = MockTritonServer(
+            http_port=0 if args.protocol == 'http' else None,
+            grpc_port=0 if args.protocol == 'grpc' else None,
+            latency=args.latency, jitter=args.jitter)
+        server.start()
+        port = server.http_port if args.protocol == 'http' else server.grpc_port
+        url = 'localhost:{}'.format(port)
+
+    if args.source is not None:
+        frames = recorded_frames(args.source, args.frames)
+    else:
+        frames = synthetic_frames(SYNTHETIC_FRAMES, args.width, args.height)
+
+    results = {}
+    for model_name in args.models:
+        client = triton_client.TritonClient(
+            url=url, max_inflight=args.inflight, protocol=args.protocol)
+        client.load_model(model_name=model_name)
+        stages = make_stages(model_name, client, args.preprocess)
+        run_frames(client, stages, frames, WARMUP_FRAMES)
+        times, fps = run_frames(client, stages, frames, args.frames)
+        client.close()
+        results[model_name] = summarize(times, fps)
+
+    if server is not None:
+        server.stop()
+
+    for model_name, summary in results.items():
+        print()
+        print('{} ({} frames, {}, {} in flight): {:.1f} FPS'.format(
+            model_name, args.frames, args.protocol, args.inflight, summary['fps']))
+        print('{:>12} {:>10} {:>10} {:>10} {:>10}'.format(
+            'stage', 'mean[ms]', *['p{}[ms]'.format(p) for p in PERCENTILES]))
+        for stage in STAGES:
+            print('{:>12} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                stage, summary[stage]['mean'],
+                *[summary[stage]['p{}'.format(p)] for p in PERCENTILES]))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('{} regressions beyond {}%'.format(regressions, args.tolerance))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import time
+import argparse
+import importlib.util
+import numpy as np
+import tritonclient.grpc.model_config_pb2 as mc
+
+
+CAPTURE_SIZES_DEFAULT = ['640x480', '1280x720', '160x120']
+REPEAT_DEFAULT = 20
+# Maximum and mean differences allowed, in 8-bit levels
+MAX_DIFF_DEFAULT = 48.0
+MEAN_DIFF_DEFAULT = 2.0
+SEED = 0
+
+# (demo, scaling, c, h, w, format) of the cases compared
+CASES = [
+    ('tiny_yolov2', None, 3, 416, 416, mc.ModelInput.FORMAT_NCHW),
+    ('tiny_yolov2', None, 3, 416, 416, mc.ModelInput.FORMAT_NHWC),
+    ('densenet_classification', 'NONE', 3, 224, 224, mc.ModelInput.FORMAT_NCHW),
+    ('densenet_classification', 'INCEPTION', 3, 224, 224, mc.ModelInput.FORMAT_NCHW),
+    ('densenet_classification', 'VGG', 3, 224, 224, mc.ModelInput.FORMAT_NHWC),
+    ('densenet_classification', 'VGG', 1, 224, 224, mc.ModelInput.FORMAT_NCHW),
+]
+
+
+def load_module(name, path):
+    '''Load a module by path, as both demos have a preprocess module.'''
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(os.path.dirname(__file__), '..', path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_frame(rng, width, height):
+    # Smooth gradients with noise and a few solid boxes, like a camera frame
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.stack(
+        (x * 255 // max(1, width - 1), y * 255 // max(1, height - 1),
+         (x + y) * 255 // max(1, width + height - 2)), axis=-1)
+    frame = frame + rng.integers(-16, 17, frame.shape)
+    for _ in range(4):
+        bx, by = rng.integers(0, width // 2), rng.integers(0, height // 2)
+        frame[by:by + height // 4, bx:bx + width // 4] = rng.integers(0, 256, 3)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def main():
+    # Parse the command line parameters
+    parser = argparse.ArgumentParser(description='Preprocessing Parity Benchmark')
+    parser.add_argument('--sizes',
+        type=str, nargs='+', default=CAPTURE_SIZES_DEFAULT, metavar='WIDTHxHEIGHT',
+        help='Capture sizes of the synthetic frames (Default: {})'.format(CAPTURE_SIZES_DEFAULT))
+    parser.add_argument('--repeat',
+        type=int, default=REPEAT_DEFAULT, metavar='REPEAT',
+        help='Repetitions per case (Default: {})'.format(REPEAT_DEFAULT))
+    parser.add_argument('--max-diff',
+        type=float, default=MAX_DIFF_DEFAULT, metavar='LEVELS',
+        help='Maximum absolute difference allowed in 8-bit levels (Default: {})'.format(MAX_DIFF_DEFAULT))
+    parser.add_argument('--mean-diff',
+        type=float, default=MEAN_DIFF_DEFAULT, metavar='LEVELS',
+        help='Mean absolute difference allowed in 8-bit levels (Default: {})'.format(MEAN_DIFF_DEFAULT))
+    args = parser.parse_args()
+
+    modules = {
+        demo: load_module(demo + '_preprocess', os.path.join(demo, 'preprocess.py'))
+        for demo in set(case[0] for case in CASES)
+    }
+    rng = np.random.default_rng(SEED)
+    failures = 0
+    print('{:>24} {:>10} {:>2} {:>5} {:>10} {:>9} {:>9} {:>9} {:>10}'.format(
+        'demo', 'scaling', 'c', 'fmt', 'capture', 'max', 'mean', 'pil[ms]', 'opencv[ms]'))
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split('x'))
+        frame = synthetic_frame(rng, width, height)
+        for demo, scaling, c, h, w, format in CASES:
+            module = modules[demo]
+            extra = () if scaling is None else (scaling,)
+            reference = module.preprocess(frame, format, 'FP32', c, h, w, *extra)
+            out = np.empty(reference.shape, dtype=np.float32)
+
+            def opencv():
+                return module.preprocess_opencv(
+                    frame, format, 'FP32', c, h, w, *extra, out=out)
+
+            result = opencv()
+            # Back to 8-bit levels, INCEPTION scaling divides by 127.5
+            unit = 127.5 if scaling == 'INCEPTION' else 1.0
+            diff = np.abs(result - reference) * unit
+            max_diff, mean_diff = float(diff.max()), float(diff.mean())
+            ok = max_diff <= args.max_diff and mean_diff <= args.mean_diff
+            failures += not ok
+            pil_time = measure(
+                lambda: module.preprocess(frame, format, 'FP32', c, h, w, *extra),
+                args.repeat)
+            opencv_time = measure(opencv, args.repeat)
+            print('{:>24} {:>10} {:>2} {:>5} {:>10} {:>9.2f} {:>9.3f} {:>9.3f} {:>10.3f}{}'.format(
+                demo, scaling or '-', c, mc.ModelInput.Format.Name(format)[7:], size,
+                max_diff, mean_diff, pil_time * 1000, opencv_time * 1000,
+                '' if ok else '  FAILED'))
+
+    if failures:
+        print('{} cases differ from the PIL backend beyond the tolerance'.format(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
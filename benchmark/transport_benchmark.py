@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import triton_client
+import aio_triton_client
+from mock_triton_server import MockTritonServer
+
+
+MODEL_NAME_DEFAULT = 'tinyyolov2_onnx'
+REQUESTS_DEFAULT = 200
+WARMUP_REQUESTS = 10
+TRANSPORTS = [
+    # (label, protocol, stream, shared_memory)
+    ('http', 'http', False, False),
+    ('http-shm', 'http', False, True),
+    ('grpc', 'grpc', False, False),
+    ('grpc-shm', 'grpc', False, True),
+    ('grpc-stream', 'grpc', True, False),
+]
+AIO_TRANSPORTS = [
+    # (label, protocol)
+    ('http-aio', 'http'),
+    ('grpc-aio', 'grpc'),
+]
+
+
+def run_transport(url, protocol, stream, shared_memory, model_name, count):
+    client = triton_client.TritonClient(
+        url=url, protocol=protocol, stream=stream, shared_memory=shared_memory)
+    client.load_model(model_name=model_name)
+    image = client.get_input_buffer()
+    image[...] = np.random.default_rng(0).random(image.shape)
+
+    latencies = []
+    for i in range(WARMUP_REQUESTS + count):
+        start = time.perf_counter()
+        client.infer(image)
+        client.get_results()
+        if i >= WARMUP_REQUESTS:
+            latencies.append(time.perf_counter() - start)
+    client.close()
+    return np.array(latencies)
+
+
+async def run_aio_transport(url, protocol, model_name, count):
+    async with aio_triton_client.AsyncTritonClient(
+            url=url, protocol=protocol) as client:
+        await client.load_model(model_name=model_name)
+        image = np.random.default_rng(0).random(
+            (client.c, client.h, client.w)).astype(np.float32)
+
+        latencies = []
+        for i in range(WARMUP_REQUESTS + count):
+            start = time.perf_counter()
+            await client.infer(image)
+            if i >= WARMUP_REQUESTS:
+                latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def main():
+    # Parse the command line parameters
+    parser = argparse.ArgumentParser(description='Triton Transport Benchmark')
+    parser.add_argument('--model',
+        type=str, default=MODEL_NAME_DEFAULT, metavar='MODEL_NAME',
+        help='Model Name (Default: {})'.format(MODEL_NAME_DEFAULT))
+    parser.add_argument('--requests',
+        type=int, default=REQUESTS_DEFAULT, metavar='REQUESTS',
+        help='Requests per Transport (Default: {})'.format(REQUESTS_DEFAULT))
+    parser.add_argument('--http-url',
+        type=str, default=None, metavar='HTTP_URL',
+        help='HTTP URL of a running server (Default: local mock server)')
+    parser.add_argument('--grpc-url',
+        type=str, default=None, metavar='GRPC_URL',
+        help='gRPC URL of a running server (Default: local mock server)')
+    args = parser.parse_args()
+
+    server = None
+    if args.http_url is None or args.grpc_url is None:
+        # Let the OS pick free ports
+        server = MockTritonServer(http_port=0, grpc_port=0)
+        server.start()
+    urls = {
+        'http': args.http_url or 'localhost:{}'.format(server.http_port),
+        'grpc': args.grpc_url or 'localhost:{}'.format(server.grpc_port),
+    }
+
+    results = []
+    for label, protocol, stream, shared_memory in TRANSPORTS:
+        latencies = run_transport(
+            urls[protocol], protocol, stream, shared_memory, args.model, args.requests)
+        results.append((label, latencies))
+    for label, protocol in AIO_TRANSPORTS:
+        latencies = asyncio.run(run_aio_transport(
+            urls[protocol], protocol, args.model, args.requests))
+        results.append((label, latencies))
+
+    if server is not None:
+        server.stop()
+
+    print()
+    print('{:>12} {:>10} {:>10} {:>10} {:>10}'.format(
+        'transport', 'mean[ms]', 'p50[ms]', 'p99[ms]', 'req/s'))
+    for label, latencies in results:
+        print('{:>12} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.1f}'.format(
+            label, latencies.mean() * 1000,
+            np.percentile(latencies, 50) * 1000,
+            np.percentile(latencies, 99) * 1000,
+            1.0 / latencies.mean()))
+
+
+if __name__ == '__main__':
+    main()
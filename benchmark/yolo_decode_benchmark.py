@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import math
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'tiny_yolov2'))
+from data_processing import PostprocessYOLO
+
+
+FRAMES_DEFAULT = 8
+DETECTIONS_DEFAULT = 4
+REPEAT_DEFAULT = 10
+# float32 decode against the float64 scalar reference
+RTOL = 1e-4
+ATOL = 1e-5
+SEED = 0
+
+
+def make_postprocessor(early_reject):
+    # Tiny YOLO v2 settings of the demo
+    return PostprocessYOLO(
+        yolo_masks=[(0, 1, 2, 3, 4)],
+        yolo_anchors=[(1.08, 1.19), (3.42, 4.41), (6.63, 11.38), (9.42, 5.11), (16.62, 10.52)],
+        obj_threshold=0.5, nms_threshold=0.3,
+        yolo_input_resolution=(416, 416), num_categories=20,
+        early_reject=early_reject)
+
+
+def make_output(rng, detections):
+    # Mostly background cells, with a few confident detections
+    grid = rng.normal(0.0, 1.0, (1, 125, 13, 13)).astype(np.float32)
+    objectness = grid.reshape(5, 25, 13, 13)[:, 4]
+    objectness[...] = -6.0
+    for _ in range(detections):
+        anchor, row, col = rng.integers(0, 5), rng.integers(0, 13), rng.integers(0, 13)
+        objectness[anchor, row, col] = rng.uniform(0.0, 6.0)
+    return grid
+
+
+def scalar_decode(postprocessor, output_reshaped, mask):
+    '''The element by element decode PostprocessYOLO used before it was
+    vectorized, for a (height,width,num_anchors,box_params) output.
+    '''
+    sigmoid_v = np.vectorize(lambda value: 1.0 / (1.0 + math.exp(-value)))
+    exponential_v = np.vectorize(math.exp)
+
+    grid_h, grid_w, _, _ = output_reshaped.shape
+
+    anchors = [postprocessor.anchors[i] for i in mask]
+    anchors_tensor = np.reshape(anchors, [1, 1, len(anchors), 2])
+    box_xy = sigmoid_v(output_reshaped[..., :2])
+    box_wh = exponential_v(output_reshaped[..., 2:4]) * anchors_tensor * 32.0
+    box_confidence = sigmoid_v(output_reshaped[..., 4])
+
+    box_confidence = np.expand_dims(box_confidence, axis=-1)
+    box_class_probs = sigmoid_v(output_reshaped[..., 5:])
+
+    col = np.tile(np.arange(0, grid_w), grid_w).reshape(-1, grid_w)
+    row = np.tile(np.arange(0, grid_h).reshape(-1, 1), grid_h)
+    col = col.reshape(grid_h, grid_w, 1, 1).repeat(len(mask), axis=-2)
+    row = row.reshape(grid_h, grid_w, 1, 1).repeat(len(mask), axis=-2)
+    grid = np.concatenate((col, row), axis=-1)
+
+    box_xy += grid
+    box_xy /= (grid_w, grid_h)
+    box_wh /= postprocessor.input_resolution_yolo
+    box_xy -= (box_wh / 2.)
+    boxes = np.concatenate((box_xy, box_wh), axis=-1)
+    return boxes, box_confidence, box_class_probs
+
+
+def check_parity(dense, sparse, output):
+    '''Assert that the vectorized decodes match the scalar reference.'''
+    mask = dense.masks[0]
+    output_reshaped = dense._reshape_output(output)
+    expected = scalar_decode(dense, output_reshaped[0], mask)
+    decoded = dense._process_feats(output_reshaped, mask)
+    for name, a, b in zip(('boxes', 'confidences', 'class probabilities'),
+                          expected, decoded):
+        assert np.allclose(a, b[0], rtol=RTOL, atol=ATOL), \
+            '{} differ from the scalar decode'.format(name)
+
+    # The early rejected cells are the ones the filter drops anyway
+    _, boxes, classes, scores = dense._filter_boxes(
+        *[a[np.newaxis] for a in expected])
+    _, sparse_boxes, sparse_classes, sparse_scores = \
+        sparse._process_feats_sparse(output_reshaped, mask)
+    assert np.array_equal(classes, sparse_classes), 'classes differ'
+    assert np.allclose(boxes, sparse_boxes, rtol=RTOL, atol=ATOL), 'boxes differ'
+    assert np.allclose(scores, sparse_scores, rtol=RTOL, atol=ATOL), 'scores differ'
+    return len(scores)
+
+
+def measure(func, outputs, repeat):
+    # Median time per frame
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for output in outputs:
+            func(output)
+        times.append((time.perf_counter() - start) / len(outputs))
+    return np.median(times)
+
+
+def main():
+    # Parse the command line parameters
+    parser = argparse.ArgumentParser(description='YOLO Decode Benchmark')
+    parser.add_argument('--frames',
+        type=int, default=FRAMES_DEFAULT, metavar='FRAMES',
+        help='Synthetic Tiny YOLO v2 outputs (Default: {})'.format(FRAMES_DEFAULT))
+    parser.add_argument('--detections',
+        type=int, default=DETECTIONS_DEFAULT, metavar='DETECTIONS',
+        help='Candidate cells per output (Default: {})'.format(DETECTIONS_DEFAULT))
+    parser.add_argument('--repeat',
+        type=int, default=REPEAT_DEFAULT, metavar='REPEAT',
+        help='Repetitions per method (Default: {})'.format(REPEAT_DEFAULT))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(SEED)
+    outputs = [make_output(rng, args.detections) for _ in range(args.frames)]
+    dense = make_postprocessor(False)
+    sparse = make_postprocessor(True)
+
+    kept = sum(check_parity(dense, sparse, output) for output in outputs)
+    print('Parity with the scalar decode: OK ({} boxes over {} frames)'.format(
+        kept, len(outputs)))
+
+    mask = dense.masks[0]
+    methods = [
+        ('scalar', lambda output: scalar_decode(
+            dense, dense._reshape_output(output)[0], mask)),
+        ('vectorized', lambda output: dense._process_feats(
+            dense._reshape_output(output), mask)),
+        ('sparse', lambda output: sparse._process_feats_sparse(
+            sparse._reshape_output(output), mask)),
+        ('process', lambda output: sparse.process([output], (640, 480))),
+    ]
+    print('{:>12} {:>12}'.format('method', 'frame[ms]'))
+    for name, func in methods:
+        # The scalar decode is slow, a single pass is enough
+        repeat = 1 if name == 'scalar' else args.repeat
+        print('{:>12} {:>12.3f}'.format(name, measure(func, outputs, repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -26,11 +26,13 @@
 import cv2
 import sys
 import os
+import time
 import numpy as np
 import argparse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 import interval_counter
+import result_sink
 
 
 WINDOW_TITLE = 'Camera Test'
@@ -70,6 +72,9 @@ def main():
     parser.add_argument('--height',
         type=int, default=CAPTURE_HEIGHT_DEFAULT, metavar='CAPTURE_HEIGHT',
         help='Capture Height (Default: {})'.format(CAPTURE_HEIGHT_DEFAULT))
+    parser.add_argument('--headless',
+        action='store_true',
+        help='No window, write the FPS every second as JSON Lines')
     args = parser.parse_args()
 
     # Initialize camera device
@@ -87,28 +92,51 @@ def main():
     # Define the function to detect window close event
     was_window_closed = lambda: cv2.getWindowProperty(WINDOW_TITLE, cv2.WND_PROP_VISIBLE) < 1
 
-    while True:
-        # Capture frame n
-        ret, frame = cap.read()
-
-        # Get interval value
-        interval = fps_counter.measure()
-
-        draw_info(frame, interval)
-
-        # Show captured frame n
-        cv2.imshow(WINDOW_TITLE, frame)
-
-        # Check if ESC pressed
-        key = cv2.waitKey(1)
-        if key == 27:  # ESC
-            break
-        # Check if the window was closed
-        if was_window_closed():
-            break
-
-    cv2.destroyAllWindows()
-    cap.release()
+    sink = result_sink.JsonLinesSink() if args.headless else None
+    report_time = time.time()
+
+    try:
+        while True:
+            # Capture frame n
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            # Get interval value
+            interval = fps_counter.measure()
+
+            if args.headless:
+                if time.time() - report_time >= 1.0:
+                    report_time = time.time()
+                    height, width, _ = frame.shape
+                    sink.write({
+                        'frame': fps_counter.count, 'time': report_time,
+                        'width': width, 'height': height,
+                        'fps': None if interval is None else 1.0 / interval
+                    })
+                continue
+
+            draw_info(frame, interval)
+
+            # Show captured frame n
+            cv2.imshow(WINDOW_TITLE, frame)
+
+            # Check if ESC pressed
+            key = cv2.waitKey(1)
+            if key == 27:  # ESC
+                break
+            # Check if the window was closed
+            if was_window_closed():
+                break
+    except KeyboardInterrupt:
+        # Ctrl+C ends a headless run
+        pass
+    finally:
+        if sink is not None:
+            sink.close()
+        else:
+            cv2.destroyAllWindows()
+        cap.release()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+import sys
+import numpy as np
+from attrdict import AttrDict
+
+import tritonclient.http.aio as aiohttpclient
+import tritonclient.grpc.aio as aiogrpcclient
+from tritonclient.utils import InferenceServerException
+
+from triton_client import TritonClientError, parse_model, parse_url
+
+
+class AsyncTritonClient():
+    '''asyncio variant of TritonClient.
+
+    infer is a coroutine which returns the output of its own request, so a
+    single event loop can keep requests in flight for many cameras and
+    models at once, without threads or a blocking get_results. A request
+    is cancelled by cancelling the task awaiting it, and times out after
+    timeout seconds, raising TritonClientError.
+
+    Attributes:
+        protocol: Protocol of the server, http or grpc.
+        max_inflight: Maximum number of requests in flight at once.
+        timeout: Default timeout of a request in seconds, None to wait forever.
+        request_count: Number of requests submitted.
+    '''
+
+    def __init__(self, url='localhost:8000', max_inflight=8, timeout=None,
+                 protocol=None):
+        '''
+        Args:
+            url(str): Server URL, with an optional http:// or grpc:// scheme.
+            max_inflight(int): Maximum number of requests in flight at once,
+                further requests wait for a free slot.
+            timeout(float): Default timeout of a request in seconds.
+            protocol(str): Protocol used when the URL has no scheme.
+        '''
+        self.protocol, url = parse_url(url, protocol)
+        if self.protocol == 'grpc':
+            self.protocol_client = aiogrpcclient
+        else:
+            self.protocol_client = aiohttpclient
+        self.max_inflight = max(1, max_inflight)
+        self.timeout = timeout
+        self.request_count = 0
+        self.requested_outputs = {}
+        # Created lazily, as it must belong to the loop running the requests
+        self.inflight = None
+
+        try:
+            if self.protocol == 'grpc':
+                self.client = aiogrpcclient.InferenceServerClient(
+                    url=url, verbose=False
+                )
+            else:
+                self.client = aiohttpclient.InferenceServerClient(
+                    url=url, verbose=False, conn_limit=self.max_inflight
+                )
+        except Exception as e:
+            print('could not create client: {}'.format(e), file=sys.stderr)
+            raise TritonClientError(str(e))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        await self.client.close()
+
+    async def load_model(self, model_name='inception_graphdef', model_version=''):
+        # Only load a model which is not ready, as TritonClient.load_model
+        if not await self.client.is_model_ready(model_name, model_version):
+            try:
+                await self.client.load_model(model_name)
+            except InferenceServerException as e:
+                print('Could not load the model: {}'.format(e), file=sys.stderr)
+                raise TritonClientError(str(e))
+
+            if not await self.client.is_model_ready(model_name, model_version):
+                raise TritonClientError('model loading failure')
+
+        try:
+            model_metadata = await self.client.get_model_metadata(
+                model_name=model_name, model_version=model_version
+            )
+        except InferenceServerException as e:
+            print('Could not retrive metadata: {}'.format(e), file=sys.stderr)
+            raise TritonClientError(str(e))
+
+        try:
+            model_config = await self.client.get_model_config(
+                model_name=model_name, model_version=model_version
+            )
+        except InferenceServerException as e:
+            print('Could not retrive config: {}'.format(e), file=sys.stderr)
+            raise TritonClientError(str(e))
+
+        if self.protocol == 'grpc':
+            self.model_metadata = model_metadata
+            self.model_config = model_config.config
+        else:
+            self.model_metadata = AttrDict(model_metadata)
+            self.model_config = AttrDict(model_config)
+        self.model_name = model_name
+        self.model_version = model_version
+
+        self.max_batch_size, self.input_name, self.output_name, \
+        self.c, self.h, self.w, self.format, self.dtype = parse_model(
+            self.model_metadata, self.model_config
+        )
+        self.requested_outputs = {}
+
+    def _get_requested_output(self, class_count):
+        output = self.requested_outputs.get(class_count)
+        if output is None:
+            if self.protocol == 'http':
+                output = aiohttpclient.InferRequestedOutput(
+                    self.output_name, binary_data=True, class_count=class_count
+                )
+            else:
+                output = aiogrpcclient.InferRequestedOutput(
+                    self.output_name, class_count=class_count
+                )
+            self.requested_outputs[class_count] = output
+        return output
+
+    async def infer(self, image, class_count=0, timeout=None):
+        '''Run one image through the model and return its output,
+        with a leading batch axis as TritonClient.get_results.
+
+        Args:
+            image: Preprocessed image.
+            class_count(int): Number of classes to return.
+            timeout(float): Timeout in seconds, defaults to the client timeout.
+        '''
+        tensor = image[np.newaxis, :] if self.max_batch_size > 0 else image
+        output_array = await self._infer(tensor, class_count, timeout)
+        if self.max_batch_size <= 0:
+            output_array = output_array[np.newaxis, :]
+        return output_array
+
+    async def infer_batch(self, images, class_count=0, timeout=None):
+        '''Run several images through the model in a single request and
+        return the output, with one row per image.
+
+        Args:
+            images: Sequence of preprocessed images, at most max_batch_size.
+            class_count(int): Number of classes to return per image.
+            timeout(float): Timeout in seconds, defaults to the client timeout.
+        '''
+        batch_size = len(images)
+        if self.max_batch_size <= 0 or batch_size > self.max_batch_size:
+            raise TritonClientError(
+                'batch of {} exceeds max_batch_size {}'.format(
+                    batch_size, self.max_batch_size))
+        return await self._infer(np.stack(images), class_count, timeout)
+
+    async def _infer(self, tensor, class_count, timeout):
+        if self.inflight is None:
+            self.inflight = asyncio.Semaphore(self.max_inflight)
+        if timeout is None:
+            timeout = self.timeout
+
+        # The input is serialized when the request is built, so it is not
+        # shared between the requests in flight
+        infer_input = self.protocol_client.InferInput(
+            self.input_name, tensor.shape, self.dtype
+        )
+        infer_input.set_data_from_numpy(tensor)
+        request_id = str(self.request_count)
+        self.request_count += 1
+
+        async with self.inflight:
+            try:
+                # Cancelling the task awaiting infer cancels the request too
+                response = await asyncio.wait_for(
+                    self.client.infer(
+                        self.model_name, [infer_input], request_id=request_id,
+                        model_version=self.model_version,
+                        outputs=[self._get_requested_output(class_count)]
+                    ),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                print('Inference timed out after {} s'.format(timeout), file=sys.stderr)
+                raise TritonClientError('request {} timed out'.format(request_id))
+            except InferenceServerException as e:
+                print('Inference failed: {}'.format(e), file=sys.stderr)
+                raise TritonClientError(str(e))
+
+        return response.as_numpy(self.output_name)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import time
+import threading
+import collections
+from concurrent.futures import Future
+
+from triton_client import TritonClientError, batch_item
+
+
+class DynamicBatcher():
+    '''Client-side dynamic batching in front of a TritonClient.
+
+    Frames submitted from any number of threads are coalesced into a single
+    request of up to max_batch_size frames, or fewer once the oldest queued
+    frame has waited max_queue_delay seconds. Each frame gets a Future that
+    is resolved with its own row of the batched output, with a batch dimension
+    of 1 as get_results returns it for a single image. All the calls to the
+    TritonClient are made from the batcher thread.
+
+    Attributes:
+        client: TritonClient with a loaded model.
+        max_batch_size: Maximum number of frames per request.
+        max_queue_delay: Maximum time a frame waits for others to join its batch.
+        class_count: Number of classes requested per frame.
+        batch_count: Number of requests sent.
+        frame_count: Number of frames sent.
+    '''
+
+    def __init__(self, client, max_batch_size=None, max_queue_delay=0.005,
+                 class_count=0):
+        '''
+        Args:
+            client(TritonClient): Client with a loaded model.
+            max_batch_size(int): Maximum number of frames per request.
+                Defaults to the max_batch_size of the model.
+            max_queue_delay(float): Maximum queueing delay in seconds.
+            class_count(int): Number of classes requested per frame.
+        '''
+        self.client = client
+        model_batch_size = max(1, client.max_batch_size)
+        if max_batch_size is None:
+            max_batch_size = model_batch_size
+        self.max_batch_size = max(1, min(max_batch_size, model_batch_size))
+        self.max_queue_delay = max_queue_delay
+        self.class_count = class_count
+        self.batch_count = 0
+        self.frame_count = 0
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        # Futures of the submitted requests, oldest first
+        self._inflight = collections.deque()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        '''Queue a preprocessed image for inference.
+
+        Args:
+            image: Preprocessed image without the batch dimension.
+
+        Returns:
+            A Future resolved with the output array of this image, or its
+            list of output arrays for a model with several outputs.
+        '''
+        future = Future()
+        with self._cond:
+            if not self._running:
+                raise TritonClientError('batcher is closed')
+            self._queue.append((time.perf_counter(), image, future))
+            self._cond.notify()
+        return future
+
+    def close(self):
+        '''Stop the batcher once the queued frames have been processed.'''
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+    def _collect(self):
+        with self._cond:
+            # Do not sleep while results are waiting to be collected
+            if not self._queue and self._running and not self._inflight:
+                self._cond.wait_for(lambda: self._queue or not self._running)
+            if not self._queue:
+                return []
+
+            deadline = self._queue[0][0] + self.max_queue_delay
+            while len(self._queue) < self.max_batch_size and self._running:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                self._cond.wait(timeout)
+
+            count = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _send(self, items):
+        # Frames whose future was cancelled are not sent, the others can no
+        # longer be cancelled
+        items = [item for item in items if item[2].set_running_or_notify_cancel()]
+        if not items:
+            return
+        images = [image for _, image, _ in items]
+        futures = [future for _, _, future in items]
+        try:
+            if self.client.max_batch_size > 0:
+                self.client.infer_batch(images, class_count=self.class_count)
+            else:
+                self.client.infer(images[0], class_count=self.class_count)
+        except Exception as e:
+            self._fail(futures, e)
+            return
+        self._inflight.append(futures)
+        self.batch_count += 1
+        self.frame_count += len(futures)
+
+    def _scatter(self, drain):
+        try:
+            output_array = self.client.get_results(drain=drain)
+        except Exception as e:
+            # The oldest request failed
+            self._fail(self._inflight.popleft(), e)
+            return True
+        if output_array is None:
+            return False
+        futures = self._inflight.popleft()
+        try:
+            outputs = [batch_item(output_array, slice(i, i + 1))
+                       for i in range(len(futures))]
+        except Exception as e:
+            self._fail(futures, e)
+            return True
+        for future, output in zip(futures, outputs):
+            future.set_result(output)
+        return True
+
+    def _fail(self, futures, error):
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    def _run(self):
+        try:
+            self._process()
+        except Exception as e:
+            # Do not leave any frame waiting for a thread which is gone
+            with self._cond:
+                self._running = False
+                items = list(self._queue)
+                self._queue.clear()
+            self._fail([future for _, _, future in items], e)
+            while self._inflight:
+                self._fail(self._inflight.popleft(), e)
+
+    def _process(self):
+        while True:
+            items = self._collect()
+            if items:
+                # Make room in the window so that sending never blocks on an older request
+                while len(self._inflight) >= self.client.max_inflight:
+                    self._scatter(drain=True)
+                self._send(items)
+                # Collect the results the window releases
+                while self._inflight and self._scatter(drain=False):
+                    pass
+            elif self._inflight:
+                # Idle: drain the oldest request instead of waiting for the window to fill
+                self._scatter(drain=True)
+
+            with self._cond:
+                if not self._running and not self._queue and not self._inflight:
+                    return
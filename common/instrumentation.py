@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Histogram resolution: 2 ** SUB_BUCKET_BITS buckets per power of two of
+# microseconds above that, which bounds the relative error below 1 / 64
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+# Longest value recorded, larger values fall into the last bucket
+MAX_VALUE_US = 100 * 1000 * 1000
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+def _bucket_index(value):
+    exponent = max(0, value.bit_length() - SUB_BUCKET_BITS)
+    return exponent * SUB_BUCKET_HALF + (value >> exponent)
+
+
+def _bucket_value(index):
+    exponent = max(0, index // SUB_BUCKET_HALF - 1)
+    base = (index - exponent * SUB_BUCKET_HALF) << exponent
+    # Middle of the bucket
+    return base + ((1 << exponent) - 1) / 2
+
+
+class LatencyHistogram():
+    '''A histogram of durations in the manner of HdrHistogram: log-linear
+    buckets of microseconds with a bounded relative error, so recording is
+    a few integer operations and the quantiles need no stored samples.
+
+    Attributes:
+        count: Number of values recorded.
+        total: Sum of the values in seconds.
+        min: Smallest value in seconds, or None.
+        max: Largest value in seconds, or None.
+    '''
+
+    def __init__(self):
+        self.counts = [0] * (_bucket_index(MAX_VALUE_US) + 1)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        '''Record a duration in seconds.'''
+        index = _bucket_index(min(max(0, int(seconds * 1e6)), MAX_VALUE_US))
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+            if self.max is None or seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        '''Return the q quantile in seconds, for instance 0.99 for p99,
+        or None if no value was recorded.
+        '''
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = max(1, round(q * self.count))
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    value = _bucket_value(index) / 1e6
+                    # The bucket may be wider than the recorded range
+                    return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else None
+
+
+class _Span():
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+class _NullSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation():
+    '''Latency histograms of named stages, fed by spans timed with the
+    monotonic clock around the hot path:
+
+        with metrics.span('preprocess'):
+            image = preprocess(frame)
+
+    When disabled, span returns a shared object doing nothing, so the
+    instrumented code costs a method call per span.
+
+    The histograms can be printed as a periodic summary, or served as
+    Prometheus text on /metrics.
+
+    Attributes:
+        enabled: False to record nothing.
+        histograms: LatencyHistogram by stage name, in creation order.
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.reporter = None
+        self.http_server = None
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def span(self, name):
+        '''Return a context manager timing its block into the name stage.'''
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self.histogram(name))
+
+    def record(self, name, seconds):
+        '''Record a duration measured by the caller, for instance across threads.'''
+        if self.enabled:
+            self.histogram(name).record(seconds)
+
+    def summary(self):
+        '''Return a line per stage with its count, mean and quantiles in ms.'''
+        lines = []
+        for name, histogram in list(self.histograms.items()):
+            if histogram.count == 0:
+                continue
+            items = ['mean {:.2f}'.format(histogram.mean() * 1000)]
+            for q in QUANTILES:
+                items.append('p{:g} {:.2f}'.format(
+                    q * 100, histogram.quantile(q) * 1000))
+            lines.append('{:>12}: {} ms (n={})'.format(
+                name, ' '.join(items), histogram.count))
+        return '\n'.join(lines)
+
+    def prometheus(self, metric='pipeline_stage_seconds'):
+        '''Return the histograms in the Prometheus text format, as summaries.'''
+        lines = [
+            '# HELP {} Latency of the pipeline stages.'.format(metric),
+            '# TYPE {} summary'.format(metric),
+        ]
+        for name, histogram in list(self.histograms.items()):
+            if histogram.count == 0:
+                continue
+            for q in QUANTILES:
+                lines.append('{}{{stage="{}",quantile="{:g}"}} {:.6f}'.format(
+                    metric, name, q, histogram.quantile(q)))
+            lines.append('{}_sum{{stage="{}"}} {:.6f}'.format(
+                metric, name, histogram.total))
+            lines.append('{}_count{{stage="{}"}} {}'.format(
+                metric, name, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def start_reporter(self, interval, file=None):
+        '''Print the summary every interval seconds, by default to stderr,
+        as the standard output may carry the results.
+        '''
+        file = sys.stderr if file is None else file
+
+        def report():
+            # Once more on close, with the final counts
+            while True:
+                stopped = self.stop_event.wait(interval)
+                summary = self.summary()
+                if summary:
+                    print(summary, file=file, flush=True)
+                if stopped:
+                    break
+
+        self.reporter = threading.Thread(target=report, daemon=True)
+        self.reporter.start()
+
+    def serve(self, port, host=''):
+        '''Serve the Prometheus text on http://host:port/metrics.'''
+        handler = type('Handler', (_MetricsHandler,), {'instrumentation': self})
+        self.http_server = ThreadingHTTPServer((host, port), handler)
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.reporter is not None:
+            self.reporter.join()
+            self.reporter = None
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+
+# Shared by the code which is not given an Instrumentation
+DISABLED = Instrumentation(enabled=False)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    instrumentation = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.instrumentation.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
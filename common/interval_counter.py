@@ -23,17 +23,23 @@
 # SOFTWARE.
 
 
+import sys
 import time
-import numpy as np
+import threading
 
 
 class IntervalCounter():
     '''A counter to measure the interval between the measure method calls.
 
+    The last intervals are kept in a circular buffer with their running sums,
+    so measure takes constant time and allocates nothing. The minimum,
+    maximum, percentiles and jitter are computed from the buffer on demand,
+    for reporting.
+
     Attributes:
         numSamples: Number of samples to calculate the average.
-        samples: Buffer to store the last N intervals.
-        lastTime: Last time stamp
+        samples: Circular buffer of the last N intervals.
+        lastTime: Last time stamp, from the monotonic clock.
         count: Total counts
     '''
 
@@ -42,14 +48,14 @@ class IntervalCounter():
         Args:
             numSamples(int): Number of samples to calculate the average.
         '''
-        self.numSamples = numSamples
-        self.samples = np.zeros(self.numSamples)
-        self.lastTime = time.time()
+        self.numSamples = max(1, numSamples)
+        self.samples = [0.0] * self.numSamples
+        self.index = 0
+        self.sum = 0.0
+        self.squareSum = 0.0
+        self.lastTime = time.perf_counter()
         self.count = 0
 
-    def __del__(self):
-        pass
-
     def measure(self):
         '''Measure the interval from the last call.
 
@@ -58,13 +64,123 @@ class IntervalCounter():
             If the number timestamps captured in less than numSamples,
             None will be returned.
         '''
-        curTime = time.time()
+        curTime = time.perf_counter()
         elapsedTime = curTime - self.lastTime
         self.lastTime = curTime
-        self.samples = np.append(self.samples, elapsedTime)
-        self.samples = np.delete(self.samples, 0)
+        oldest = self.samples[self.index]
+        self.samples[self.index] = elapsedTime
+        self.index += 1
+        if self.index == self.numSamples:
+            self.index = 0
+            # Recompute the sums once per round, not to accumulate rounding errors
+            self.sum = sum(self.samples)
+            self.squareSum = sum(sample * sample for sample in self.samples)
+        else:
+            self.sum += elapsedTime - oldest
+            self.squareSum += elapsedTime * elapsedTime - oldest * oldest
         self.count += 1
         if self.count > self.numSamples:
-            return np.average(self.samples)
+            return self.sum / self.numSamples
         else:
             return None
+
+    def _filled(self):
+        # The samples measured so far, at most numSamples
+        return self.samples[:min(self.count, self.numSamples)]
+
+    def average(self):
+        '''Return the average interval, or None if nothing was measured.'''
+        count = min(self.count, self.numSamples)
+        return self.sum / count if count > 0 else None
+
+    def fps(self):
+        average = self.average()
+        return 1.0 / average if average else None
+
+    def min(self):
+        samples = self._filled()
+        return min(samples) if samples else None
+
+    def max(self):
+        samples = self._filled()
+        return max(samples) if samples else None
+
+    def percentile(self, q):
+        '''Return the q percentile of the intervals, for instance 99 for p99,
+        or None if nothing was measured.
+        '''
+        samples = sorted(self._filled())
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100.0 * len(samples)))]
+
+    def jitter(self):
+        '''Return the standard deviation of the intervals, or None if
+        nothing was measured.
+        '''
+        count = min(self.count, self.numSamples)
+        if count == 0:
+            return None
+        mean = self.sum / count
+        return max(0.0, self.squareSum / count - mean * mean) ** 0.5
+
+
+class IntervalRegistry():
+    '''Named IntervalCounters, such as one per stream and a total, reported
+    together on a line by a single thread, however many there are.
+
+    Attributes:
+        counters: IntervalCounter by name, in registration order.
+    '''
+
+    def __init__(self):
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.reporter = None
+
+    def register(self, name, counter):
+        with self.lock:
+            self.counters[name] = counter
+        return counter
+
+    def unregister(self, name):
+        with self.lock:
+            self.counters.pop(name, None)
+
+    def report(self, details=False):
+        '''Return a line of the FPS of every counter, with the min, p99 and
+        max intervals and the jitter in ms if details is True.
+        '''
+        with self.lock:
+            counters = list(self.counters.items())
+        items = []
+        for name, counter in counters:
+            fps = counter.fps() if counter.count > counter.numSamples else None
+            item = '{} {}'.format(name, '-' if fps is None else '{:.2f}'.format(fps))
+            if details and fps is not None:
+                item += ' ({:.1f}/{:.1f}/{:.1f} ms, jitter {:.1f} ms)'.format(
+                    counter.min() * 1000, counter.percentile(99) * 1000,
+                    counter.max() * 1000, counter.jitter() * 1000)
+            items.append(item)
+        return 'FPS: ' + ' '.join(items)
+
+    def start_reporter(self, interval=1.0, details=False, file=None):
+        '''Print the report every interval seconds, by default to stderr,
+        as the standard output may carry the results.
+        '''
+        file = sys.stderr if file is None else file
+        self.stop_event.clear()
+
+        def report():
+            while not self.stop_event.wait(interval):
+                print(self.report(details), file=file, flush=True)
+
+        self.reporter = threading.Thread(target=report, daemon=True)
+        self.reporter.start()
+
+    def stop_reporter(self):
+        self.stop_event.set()
+        if self.reporter is not None:
+            self.reporter.join()
+            self.reporter = None
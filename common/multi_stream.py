@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import queue
+import threading
+import cv2
+
+import interval_counter
+import instrumentation
+from triton_client import TritonClient
+from dynamic_batcher import DynamicBatcher
+
+
+def parse_source(source):
+    '''Return a camera ID for a number, else the source as is
+    (video file or stream URL such as rtsp://).
+    '''
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+class VideoStream():
+    '''A video source of a MultiStreamRunner with its statistics.
+
+    Attributes:
+        index: Index of the stream in the runner.
+        source: Camera ID, video file or stream URL.
+        frame_count: Number of frames captured.
+        drop_count: Number of frames dropped as the inference was busy.
+        result_count: Number of inference results.
+        interval: Average interval between the results in second, or None.
+        latest: (frame, output) of the newest result, or None.
+        finished: True once the source has no more frames.
+    '''
+
+    def __init__(self, index, source):
+        self.index = index
+        self.source = parse_source(source)
+        # Frames of a video file are all processed, live sources drop frames
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        self.capture = None
+        self.frame_count = 0
+        self.drop_count = 0
+        self.result_count = 0
+        self.interval = None
+        self.fps_counter = interval_counter.IntervalCounter(10)
+        self.latest = None
+        self.latest_sequence = 0
+        self.finished = False
+
+    def fps(self):
+        return None if self.interval is None else 1.0 / self.interval
+
+
+class MultiStreamRunner():
+    '''Run several video sources through one model, sharing a pool of Triton
+    connections instead of opening a client per source.
+
+    A capture thread per source reads and preprocesses the frames into a
+    shared bounded queue. A worker thread per connection hands them to the
+    DynamicBatcher of its TritonClient, which sends the frames of several
+    sources in a single request, up to max_inflight requests at once, and a
+    result thread per connection hands each output to the result function
+    with the frame it belongs to.
+
+    Attributes:
+        streams: List of VideoStream.
+        clients: Pool of TritonClient, one per connection.
+        batchers: DynamicBatcher of each client, once started.
+        interval: Average interval between the results of all the streams.
+        registry: IntervalRegistry of the per-stream and total FPS counters.
+        error: First error raised by a worker, or None.
+        metrics: Instrumentation recording capture, preprocess, submit and wait.
+    '''
+
+    def __init__(self, sources, url, model_name, connections=1, max_inflight=1,
+                 shared_memory=False, width=None, height=None, queue_size=None,
+                 metrics=None, model_cache=None, server_timeout=0, warmup=0,
+                 max_batch_size=None, max_queue_delay=0.005):
+        '''
+        Args:
+            sources: List of camera IDs, video files or stream URLs.
+            url(str): Triton Inference Server URL.
+            model_name(str): Model to run.
+            connections(int): Number of Triton connections shared by the streams.
+            max_inflight(int): Max requests in flight per connection.
+            shared_memory(bool): Exchange tensors through system shared memory.
+            width(int): Capture width of the cameras.
+            height(int): Capture height of the cameras.
+            queue_size(int): Frames waiting for a connection, defaults to
+                the number of requests which can be in flight.
+            metrics(Instrumentation): Where the threads record the duration
+                of their stages, None not to record them.
+            model_cache(ModelCache): Cache of the model signature.
+            server_timeout(float): Time to wait for the server to be ready
+                in seconds, 0 not to wait.
+            warmup(int): Blank requests sent by each connection before
+                the first frame.
+            max_batch_size(int): Maximum number of frames per request,
+                defaults to the number of sources.
+            max_queue_delay(float): Maximum time in seconds a frame waits
+                for the frames of other sources to join its request.
+        '''
+        self.metrics = metrics or instrumentation.DISABLED
+        self.streams = [VideoStream(i, source) for i, source in enumerate(sources)]
+        self.width = width
+        self.height = height
+        if max_batch_size is None:
+            max_batch_size = len(self.streams)
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay = max_queue_delay
+        self.clients = []
+        for _ in range(max(1, connections)):
+            client = TritonClient(
+                url=url, max_inflight=max_inflight, shared_memory=shared_memory
+            )
+            client.load_model(model_name=model_name, cache=model_cache,
+                              server_timeout=server_timeout)
+            client.warmup(warmup, batch_size=max_batch_size)
+            self.clients.append(client)
+        self.batchers = []
+        # The model specification for preprocessing
+        self.model = self.clients[0]
+        if queue_size is None:
+            queue_size = len(self.clients) * max(1, max_inflight)
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.fps_counter = interval_counter.IntervalCounter(10)
+        self.interval = None
+        self.registry = interval_counter.IntervalRegistry()
+        for stream in self.streams:
+            self.registry.register('[{}]'.format(stream.index), stream.fps_counter)
+        self.registry.register('total', self.fps_counter)
+        self.error = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self, preprocess_fn, result_fn=None, class_count=0):
+        '''Open the sources and start the threads.
+
+        Args:
+            preprocess_fn: Called as preprocess_fn(frame, model) in the capture
+                threads, returns the input image of the model.
+            result_fn: Called as result_fn(stream, sequence, frame, output) in the
+                result threads for each result, before it becomes the latest
+                result of the stream.
+            class_count(int): Number of classes requested per frame.
+        '''
+        self.preprocess_fn = preprocess_fn
+        self.result_fn = result_fn
+        self.class_count = class_count
+
+        for stream in self.streams:
+            stream.capture = cv2.VideoCapture(stream.source)
+            if not stream.capture.isOpened():
+                print('Cannot open {}'.format(stream.source), file=sys.stderr)
+                stream.finished = True
+                continue
+            if isinstance(stream.source, int):
+                if self.width is not None:
+                    stream.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+                if self.height is not None:
+                    stream.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            self.threads.append(
+                threading.Thread(target=self._capture, args=(stream,), daemon=True))
+        for client in self.clients:
+            batcher = DynamicBatcher(
+                client, self.max_batch_size, self.max_queue_delay, class_count)
+            self.batchers.append(batcher)
+            # Frames sent by the connection with their Future, oldest first
+            pending = queue.Queue()
+            # Frames a connection takes before the oldest comes back
+            room = threading.Semaphore(batcher.max_batch_size * client.max_inflight)
+            self.threads.append(threading.Thread(
+                target=self._serve, args=(batcher, pending, room), daemon=True))
+            self.threads.append(threading.Thread(
+                target=self._collect, args=(pending, room), daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        for batcher in self.batchers:
+            batcher.close()
+        self.batchers = []
+        for stream in self.streams:
+            if stream.capture is not None:
+                stream.capture.release()
+        for client in self.clients:
+            client.close()
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def fps(self):
+        return None if self.interval is None else 1.0 / self.interval
+
+    def _capture(self, stream):
+        while not self.stop_event.is_set():
+            with self.metrics.span('capture'):
+                ret, frame = stream.capture.read()
+            if not ret:
+                break
+            stream.frame_count += 1
+            with self.metrics.span('preprocess'):
+                image = self.preprocess_fn(frame, self.model)
+            job = (stream, stream.frame_count, frame, image)
+            if stream.is_file:
+                # Wait for room, but still notice a stop request
+                while not self.stop_event.is_set():
+                    try:
+                        self.jobs.put(job, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+            else:
+                try:
+                    self.jobs.put_nowait(job)
+                except queue.Full:
+                    stream.drop_count += 1
+        stream.finished = True
+
+    def _serve(self, batcher, pending, room):
+        try:
+            while True:
+                # Leave the frames to the other connections while this one is full
+                if not room.acquire(timeout=0.1):
+                    if self.stop_event.is_set():
+                        break
+                    continue
+                try:
+                    job = self.jobs.get(timeout=0.1)
+                except queue.Empty:
+                    room.release()
+                    if self.stop_event.is_set() or \
+                            all(stream.finished for stream in self.streams):
+                        break
+                    continue
+
+                stream, sequence, frame, image = job
+                with self.metrics.span('submit'):
+                    future = batcher.submit(image)
+                pending.put((stream, sequence, frame, future))
+        except Exception as e:
+            self._fail(e)
+        # Let the result thread finish once the frames sent are collected
+        pending.put(None)
+
+    def _collect(self, pending, room):
+        while True:
+            job = pending.get()
+            if job is None:
+                break
+            stream, sequence, frame, future = job
+            try:
+                with self.metrics.span('wait'):
+                    output = future.result()
+                self._complete(stream, sequence, frame, output)
+            except Exception as e:
+                self._fail(e)
+            room.release()
+
+    def _fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.stop_event.set()
+
+    def _complete(self, stream, sequence, frame, output):
+        # Called first so that the latest frame is complete once published
+        if self.result_fn is not None:
+            self.result_fn(stream, sequence, frame, output)
+        with self.lock:
+            stream.result_count += 1
+            stream.interval = stream.fps_counter.measure()
+            self.interval = self.fps_counter.measure()
+            # Connections may return the frames of a stream out of order
+            if sequence > stream.latest_sequence:
+                stream.latest_sequence = sequence
+                stream.latest = (frame, output)
+
+    def report(self, details=False):
+        '''Return a line of the per-stream and aggregate FPS.'''
+        return self.registry.report(details)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import time
+import queue
+import threading
+import collections
+import cv2
+
+import instrumentation
+
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+
+
+def expand_paths(paths):
+    '''Return the files to process: the files as given, video files or
+    images, and the images of the directories in name order.
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+    return files
+
+
+class OfflineFrame():
+    '''A frame read by a FrameReader.
+
+    Attributes:
+        source: File the frame comes from.
+        index: Frame number in a video file, from 1, or 1 for an image.
+        frame: Decoded frame.
+        image: Input image of the model.
+    '''
+
+    def __init__(self, source, index, frame, image):
+        self.source = source
+        self.index = index
+        self.frame = frame
+        self.image = image
+
+
+class FrameReader():
+    '''Decode and preprocess the frames of video files and images in a
+    background thread, up to prefetch frames ahead of the inference.
+    Unlike a camera capture, no frame is ever dropped.
+
+    Attributes:
+        files: Files to read.
+        failed: Files which could not be opened or read, skipped.
+        error: Error raised by the reader thread, or None.
+    '''
+
+    def __init__(self, paths, preprocess_fn, prefetch=32, metrics=None):
+        '''
+        Args:
+            paths: Video files, images or directories of images.
+            preprocess_fn: Called as preprocess_fn(frame) in the reader
+                thread, returns the input image of the model.
+            prefetch(int): Maximum number of frames read ahead.
+            metrics(Instrumentation): Where the decoding and preprocessing
+                are recorded as capture and preprocess, None not to record them.
+        '''
+        self.metrics = metrics or instrumentation.DISABLED
+        self.files = expand_paths(paths)
+        self.preprocess_fn = preprocess_fn
+        self.frames = queue.Queue(maxsize=max(1, prefetch))
+        self.stop_event = threading.Event()
+        self.failed = []
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __iter__(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                return
+            yield frame
+
+    def ready(self):
+        '''Return True if a frame was read ahead.'''
+        return not self.frames.empty()
+
+    def close(self):
+        '''Stop reading, the frames already read are discarded.'''
+        self.stop_event.set()
+        while self.thread.is_alive():
+            try:
+                self.frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _put(self, item):
+        # Wait for room, but still notice a stop request
+        while not self.stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _preprocess(self, frame):
+        with self.metrics.span('preprocess'):
+            return self.preprocess_fn(frame)
+
+    def _read(self, path):
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            with self.metrics.span('capture'):
+                frame = cv2.imread(path)
+            if frame is None:
+                print('Cannot read {}'.format(path), file=sys.stderr)
+                self.failed.append(path)
+                return True
+            return self._put(OfflineFrame(path, 1, frame, self._preprocess(frame)))
+
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            print('Cannot open {}'.format(path), file=sys.stderr)
+            self.failed.append(path)
+            return True
+        try:
+            index = 0
+            while True:
+                with self.metrics.span('capture'):
+                    ret, frame = capture.read()
+                if not ret:
+                    return True
+                index += 1
+                if not self._put(
+                        OfflineFrame(path, index, frame, self._preprocess(frame))):
+                    return False
+        finally:
+            capture.release()
+
+    def _run(self):
+        try:
+            for path in self.files:
+                if not self._read(path):
+                    break
+        except Exception as e:
+            self.error = e
+            print('FrameReader failed: {}'.format(e), file=sys.stderr)
+        self._put(None)
+
+
+class OfflineRunner():
+    '''Push the frames of a FrameReader through a TritonClient as fast as
+    the server allows: the frames are batched up to the max_batch_size of
+    the model, with up to max_inflight batches in flight. A smaller batch
+    is sent when no frame is ready and the server has room for a request,
+    rather than leaving it idle while the reader catches up.
+
+    Attributes:
+        client: TritonClient with a loaded model.
+        batch_size: Frames per request.
+        frame_count: Number of frames processed.
+        batch_count: Number of requests sent.
+        elapsed: Time taken by run in seconds.
+    '''
+
+    def __init__(self, client, batch_size=None, class_count=0, metrics=None):
+        '''
+        Args:
+            client(TritonClient): Client with a loaded model.
+            batch_size(int): Frames per request, defaults to the
+                max_batch_size of the model, 1 if the model cannot batch.
+            class_count(int): Number of classes requested per frame.
+            metrics(Instrumentation): Where the time spent submitting and
+                waiting for the results is recorded, None not to record it.
+        '''
+        self.metrics = metrics or instrumentation.DISABLED
+        self.client = client
+        model_batch_size = max(1, client.max_batch_size)
+        if not batch_size:
+            batch_size = model_batch_size
+        self.batch_size = max(1, min(batch_size, model_batch_size))
+        self.class_count = class_count
+        self.frame_count = 0
+        self.batch_count = 0
+        self.elapsed = 0.0
+
+    def run(self, reader, result_fn):
+        '''Process all the frames of the reader.
+
+        Args:
+            reader(FrameReader): Source of the frames.
+            result_fn: Called as result_fn(frames, output) for each batch in
+                reading order, with its list of OfflineFrame and its output,
+                which has a row per frame, as does each array of a model
+                with several outputs, so that the batch can be postprocessed
+                at once.
+
+        Raises:
+            The error which stopped the reader, once the frames read before
+            it are processed.
+        '''
+        start = time.perf_counter()
+        # Batches submitted and not yet collected, oldest first
+        pending = collections.deque()
+        batch = []
+        try:
+            for frame in reader:
+                batch.append(frame)
+                if len(batch) >= self.batch_size or (not reader.ready() and
+                        len(pending) < self.client.max_inflight):
+                    self._submit(batch, pending, result_fn)
+                    batch = []
+            if batch:
+                self._submit(batch, pending, result_fn)
+            while pending:
+                self._collect(pending, result_fn, True)
+            if reader.error is not None:
+                raise reader.error
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+    def _submit(self, batch, pending, result_fn):
+        images = [frame.image for frame in batch]
+        with self.metrics.span('submit'):
+            if self.client.max_batch_size > 0:
+                self.client.infer_batch(images, class_count=self.class_count)
+            else:
+                self.client.infer(images[0], class_count=self.class_count)
+        pending.append(batch)
+        self.batch_count += 1
+        # Collect the batch the window released, if any
+        self._collect(pending, result_fn, False)
+
+    def _collect(self, pending, result_fn, drain):
+        with self.metrics.span('wait'):
+            output_array = self.client.get_results(drain=drain)
+        if output_array is None:
+            return
+        batch = pending.popleft()
+        result_fn(batch, output_array)
+        self.frame_count += len(batch)
+
+    def fps(self):
+        return self.frame_count / self.elapsed if self.elapsed > 0 else 0.0
+
+    def report(self):
+        '''Return a line of the total throughput.'''
+        return 'Processed {} frames in {} batches of up to {} in {:.2f} s: {:.2f} FPS'.format(
+            self.frame_count, self.batch_count, self.batch_size, self.elapsed, self.fps())
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import sys
+import time
+import queue
+import threading
+import collections
+
+import instrumentation
+
+
+# Frames whose image is written before the inference stage submits it, with
+# the default queue size: the one preprocessed, the one queued and the one
+# being submitted. An input pool of max_inflight + FRAMES_AHEAD buffers lets
+# the preprocessing write into TritonClient.acquire_input_buffer. If all the
+# buffers are still in use anyway, the frame is skipped.
+FRAMES_AHEAD = 3
+
+
+class DropOldestQueue():
+    '''A bounded queue whose put never blocks: when the queue is full,
+    the oldest item is dropped to make room for the new one.
+
+    Attributes:
+        maxsize: Maximum number of items.
+        drop_count: Number of items dropped.
+        closed: True once close was called.
+        on_drop: Function called with every item dropped, or put once the
+            queue is closed, to release what it holds. None by default.
+    '''
+
+    def __init__(self, maxsize=1, on_drop=None):
+        self.maxsize = max(1, maxsize)
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.drop_count = 0
+        self.closed = False
+        self.on_drop = on_drop
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        dropped = None
+        with self.cond:
+            if self.closed:
+                dropped = item
+            else:
+                if len(self.items) >= self.maxsize:
+                    dropped = self.items.popleft()
+                    self.drop_count += 1
+                self.items.append(item)
+                self.cond.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        '''Return the oldest item, or None once the queue is closed and empty.
+        Raises queue.Empty if no item came within timeout seconds.
+        '''
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                raise queue.Empty
+            if self.items:
+                return self.items.popleft()
+            return None
+
+    def close(self):
+        '''Stop accepting items. The items already queued can still be read.'''
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class FrameItem():
+    '''A frame going through the pipeline. Each stage fills its own field.
+
+    Attributes:
+        sequence: Frame number from the capture.
+        frame: Captured frame.
+        capture_time: Time stamp of the capture.
+        image: Input image of the model.
+        output: Inference output.
+        result: Postprocessed result.
+    '''
+
+    def __init__(self, sequence, frame):
+        self.sequence = sequence
+        self.frame = frame
+        self.capture_time = time.time()
+        self.image = None
+        self.output = None
+        self.result = None
+
+
+class _StageThread(threading.Thread):
+
+    def __init__(self, in_queue, out_queue, metrics=None):
+        super().__init__(daemon=True)
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.metrics = metrics or instrumentation.DISABLED
+        self.error = None
+
+    def run(self):
+        try:
+            self.process()
+        except Exception as e:
+            self.error = e
+            print('{} failed: {}'.format(type(self).__name__, e), file=sys.stderr)
+            # Let the stages upstream stop too
+            if self.in_queue is not None:
+                self.in_queue.close()
+        self.out_queue.close()
+
+    def emit(self, item):
+        '''Pass an item downstream. Returns False once downstream stopped.'''
+        self.out_queue.put(item)
+        if self.out_queue.closed:
+            if self.in_queue is not None:
+                self.in_queue.close()
+            return False
+        return True
+
+
+class CaptureStage(_StageThread):
+    '''Read the frames of a cv2.VideoCapture at the rate of the source.'''
+
+    def __init__(self, capture, out_queue, metrics=None):
+        super().__init__(None, out_queue, metrics)
+        self.capture = capture
+
+    def process(self):
+        sequence = 0
+        while not self.out_queue.closed:
+            with self.metrics.span('capture'):
+                ret, frame = self.capture.read()
+            if not ret:
+                break
+            sequence += 1
+            if not self.emit(FrameItem(sequence, frame)):
+                break
+
+
+class Stage(_StageThread):
+    '''Apply a function to every item. The function returns the item to
+    pass downstream, or None to drop it. Its duration is recorded under
+    the name of the stage, if any.
+    '''
+
+    def __init__(self, fn, in_queue, out_queue, name=None, metrics=None):
+        super().__init__(in_queue, out_queue, metrics)
+        self.fn = fn
+        self.name = name
+
+    def process(self):
+        while True:
+            item = self.in_queue.get()
+            if item is None:
+                break
+            if self.name is not None:
+                with self.metrics.span(self.name):
+                    item = self.fn(item)
+            else:
+                item = self.fn(item)
+            if item is not None and not self.emit(item):
+                break
+
+
+class ProcessStage(_StageThread):
+    '''Run the items in a ProcessPool, keeping up to max_pending tasks in
+    flight, and pass them downstream in order. submit_fn(pool, item) submits
+    the task of an item, and finish_fn(item, result, output) completes the
+    item with what the task returned. The time from the submission of a
+    task to its result is recorded under the name of the stage, if any.
+    '''
+
+    def __init__(self, pool, submit_fn, finish_fn, in_queue, out_queue,
+                 name=None, metrics=None):
+        super().__init__(in_queue, out_queue, metrics)
+        self.pool = pool
+        self.submit_fn = submit_fn
+        self.finish_fn = finish_fn
+        self.name = name
+
+    def process(self):
+        pending = collections.deque()
+        while True:
+            try:
+                # Wait for the oldest task if no new item is ready
+                item = self.in_queue.get(timeout=0 if pending else None)
+            except queue.Empty:
+                if not self.emit(self._finish(pending)):
+                    break
+                continue
+
+            if item is None:
+                while pending:
+                    self.emit(self._finish(pending))
+                break
+
+            if len(pending) >= self.pool.max_pending and \
+                    not self.emit(self._finish(pending)):
+                break
+            pending.append(
+                (item, self.submit_fn(self.pool, item), time.perf_counter()))
+
+    def _finish(self, pending):
+        item, task, submit_time = pending.popleft()
+        result, output = task.get()
+        if self.name is not None:
+            self.metrics.record(self.name, time.perf_counter() - submit_time)
+        return self.finish_fn(item, result, output)
+
+
+class InferenceStage(_StageThread):
+    '''Submit the images of the items to a TritonClient, keeping up to
+    max_inflight requests in flight, and pass the items downstream in
+    submission order with their output. The time spent submitting and
+    waiting for the results is recorded as submit and wait.
+    '''
+
+    def __init__(self, client, in_queue, out_queue, class_count=0,
+                 idle_timeout=0.1, metrics=None):
+        super().__init__(in_queue, out_queue, metrics)
+        self.client = client
+        self.class_count = class_count
+        self.idle_timeout = idle_timeout
+
+    def process(self):
+        pending = collections.deque()
+        while True:
+            try:
+                # Collect a request in flight if no frame comes for a while
+                item = self.in_queue.get(
+                    timeout=self.idle_timeout if pending else None)
+            except queue.Empty:
+                item = self._collect(pending, True)
+                if item is not None and not self.emit(item):
+                    break
+                continue
+
+            if item is None:
+                # End of the stream, collect the remaining requests
+                while pending:
+                    self.emit(self._collect(pending, True))
+                break
+
+            with self.metrics.span('submit'):
+                self.client.infer(item.image, class_count=self.class_count)
+            pending.append(item)
+            item = self._collect(pending, False)
+            if item is not None and not self.emit(item):
+                break
+
+    def _collect(self, pending, drain):
+        with self.metrics.span('wait'):
+            output = self.client.get_results(drain=drain)
+        if output is None:
+            return None
+        item = pending.popleft()
+        item.output = output
+        return item
+
+
+class Pipeline():
+    '''Stages connected by bounded drop-oldest queues, from a capture thread
+    to the output read by the caller, usually to render the frames.
+    A stage never waits for a slower one downstream, so the capture runs at
+    the rate of the source and the freshest frames are processed.
+
+    Attributes:
+        stages: Stage threads, the capture first.
+        queues: Queues between the stages, the output last.
+        metrics: Instrumentation recording the duration of the stages.
+    '''
+
+    def __init__(self, capture, queue_size=1, metrics=None):
+        '''
+        Args:
+            capture(cv2.VideoCapture): Source of the frames.
+            queue_size(int): Size of the queue after the capture.
+            metrics(Instrumentation): Where the stages record their duration,
+                None not to record them.
+        '''
+        self.metrics = metrics or instrumentation.DISABLED
+        self.queues = [DropOldestQueue(queue_size)]
+        self.stages = [CaptureStage(capture, self.queues[0], self.metrics)]
+
+    def add_stage(self, fn, queue_size=1, name=None):
+        '''Add a stage calling fn(item) for every FrameItem.'''
+        out_queue = DropOldestQueue(queue_size)
+        self.stages.append(
+            Stage(fn, self.queues[-1], out_queue, name, self.metrics))
+        self.queues.append(out_queue)
+
+    def add_process_stage(self, pool, submit_fn, finish_fn, queue_size=1, name=None):
+        '''Add a stage running every FrameItem in a ProcessPool.'''
+        out_queue = DropOldestQueue(queue_size)
+        self.stages.append(ProcessStage(
+            pool, submit_fn, finish_fn, self.queues[-1], out_queue,
+            name, self.metrics))
+        self.queues.append(out_queue)
+
+    def add_inference_stage(self, client, class_count=0, queue_size=1):
+        '''Add a stage setting the output of every FrameItem.'''
+        # Frames dropped before inference give back their input buffer
+        self.queues[-1].on_drop = lambda item: client.release_input_buffer(item.image)
+        out_queue = DropOldestQueue(queue_size)
+        self.stages.append(InferenceStage(
+            client, self.queues[-1], out_queue, class_count, metrics=self.metrics))
+        self.queues.append(out_queue)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def close(self):
+        '''Stop the capture without waiting. The frames already captured
+        still come out of the pipeline, then get returns None.
+        '''
+        self.queues[0].close()
+
+    def stop(self):
+        '''Stop the capture and wait for the stages to finish their items.'''
+        self.close()
+        for stage in self.stages:
+            stage.join()
+
+    def get(self, timeout=None):
+        '''Return the next FrameItem out of the last stage, or None once the
+        pipeline has stopped.
+        '''
+        return self.queues[-1].get(timeout)
+
+    def error(self):
+        '''Return the first error raised by a stage, or None.'''
+        for stage in self.stages:
+            if stage.error is not None:
+                return stage.error
+        return None
+
+    def drop_counts(self):
+        '''Return the number of items dropped by each queue.'''
+        return [q.drop_count for q in self.queues]
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import threading
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class SharedArray():
+    '''A NumPy array in a shared memory block, which another process
+    attaches to by name instead of receiving a pickled copy.
+
+    Attributes:
+        shm: The shared memory block.
+        array: The array viewing the block.
+    '''
+
+    def __init__(self, shape, dtype, name=None):
+        '''
+        Args:
+            shape: Shape of the array.
+            dtype: Type of the array.
+            name(str): Name of an existing block to attach to,
+                or None to create a new block.
+        '''
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+    def spec(self):
+        '''Return what another process needs to attach to the array.'''
+        return (self.shm.name, self.array.shape, self.array.dtype.str)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+
+# Worker process state: the context made by the initializer and the
+# arrays attached so far, by name
+_worker_context = None
+_worker_arrays = {}
+
+
+def _init_worker(initializer, initkwargs):
+    global _worker_context
+    if initializer is not None:
+        _worker_context = initializer(**initkwargs)
+
+
+def _attach(spec):
+    if spec is None:
+        return None
+    name, shape, dtype = spec
+    shared = _worker_arrays.get(name)
+    if shared is None:
+        shared = SharedArray(shape, dtype, name=name)
+        _worker_arrays[name] = shared
+    return shared.array
+
+
+def _run(fn, in_spec, out_spec, args):
+    return fn(_worker_context, _attach(in_spec), _attach(out_spec), *args)
+
+
+class _Slot():
+    '''The shared arrays of a task slot, one per role, shape and type, so
+    that different kinds of tasks share the slots without reallocating.
+    '''
+
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, role, shape, dtype):
+        key = (role, tuple(shape), np.dtype(dtype).str)
+        shared = self.arrays.get(key)
+        if shared is None:
+            shared = SharedArray(shape, dtype)
+            self.arrays[key] = shared
+        return shared
+
+    def unlink(self):
+        for shared in self.arrays.values():
+            shared.unlink()
+        self.arrays = {}
+
+
+class PoolTask():
+    '''A task submitted to a ProcessPool.'''
+
+    def __init__(self, async_result, output):
+        self.async_result = async_result
+        self.shared_output = output
+        self.lock = threading.Lock()
+        self.done = False
+        self.result = None
+        self.output = None
+
+    def get(self):
+        '''Wait for the task and return (result, output), where output is a
+        copy of the output array, or None if the task has no output.
+        '''
+        with self.lock:
+            if not self.done:
+                self.result = self.async_result.get()
+                if self.shared_output is not None:
+                    # Copied out, as the slot is reused by the next tasks
+                    self.output = self.shared_output.array.copy()
+                self.done = True
+                self.shared_output = None
+        return self.result, self.output
+
+
+class ProcessPool():
+    '''A pool of worker processes for CPU bound stages such as preprocessing
+    and postprocessing, which would otherwise hold the GIL of the main process.
+
+    The input array of a task is copied into a shared memory slot, and the
+    output array is written by the worker into another one, so frames and
+    tensors are never pickled. Only the function, the small arguments and
+    the result of the function go through the pool pipes.
+
+    The function is called in a worker as fn(context, input, output, *args),
+    where context is what initializer(**initkwargs) returned in this worker.
+    It must be defined at the top level of a module, like the initializer,
+    as the workers are spawned rather than forked, which is not safe with
+    the threads of the Triton clients. Tasks can be submitted from several
+    threads, for instance by two stages of a pipeline sharing the workers.
+
+    Attributes:
+        workers: Number of worker processes.
+        max_pending: Maximum number of tasks in flight, one slot each.
+    '''
+
+    def __init__(self, workers, initializer=None, initkwargs=None, max_pending=None):
+        '''
+        Args:
+            workers(int): Number of worker processes.
+            initializer: Called once in each worker to make its context.
+            initkwargs(dict): Keyword arguments of the initializer.
+            max_pending(int): Maximum number of tasks in flight,
+                defaults to twice the number of workers.
+        '''
+        self.workers = max(1, workers)
+        if max_pending is None:
+            max_pending = 2 * self.workers
+        self.max_pending = max(1, max_pending)
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(
+            self.workers, _init_worker, (initializer, initkwargs or {})
+        )
+        self.slots = [_Slot() for _ in range(self.max_pending)]
+        self.slot_index = 0
+        self.pending = collections.deque()
+        self.lock = threading.Lock()
+
+    def submit(self, fn, array, output_shape=None, output_dtype=None, args=()):
+        '''Submit fn(context, input, output, *args) with a copy of array as
+        input and, if output_shape is given, an output array to fill.
+        Waits for the oldest task if max_pending tasks are in flight.
+
+        Returns:
+            PoolTask
+        '''
+        with self.lock:
+            return self._submit(fn, array, output_shape, output_dtype, args)
+
+    def _submit(self, fn, array, output_shape, output_dtype, args):
+        # The slot of the oldest task is reused, wait for it to complete
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().get()
+
+        slot = self.slots[self.slot_index]
+        self.slot_index = (self.slot_index + 1) % len(self.slots)
+        shared_input = slot.get('input', array.shape, array.dtype)
+        np.copyto(shared_input.array, array)
+
+        shared_output = None
+        out_spec = None
+        if output_shape is not None:
+            shared_output = slot.get('output', output_shape, output_dtype)
+            out_spec = shared_output.spec()
+
+        async_result = self.pool.apply_async(
+            _run, (fn, shared_input.spec(), out_spec, args)
+        )
+        task = PoolTask(async_result, shared_output)
+        self.pending.append(task)
+        return task
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        for slot in self.slots:
+            slot.unlink()
+        self.slots = []
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import collections
+import numpy as np
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+
+class ResultSink():
+    '''Base of the result sinks: records are queued by write, then encoded
+    as JSON Lines and written in batches by a background thread, so the
+    callers pay neither the encoding nor a system call per record.
+
+    A batch is written once batch_size records are queued, or flush_interval
+    seconds after its first record. If the output cannot keep up and
+    max_queue records are waiting, the oldest ones are dropped.
+
+    Attributes:
+        record_count: Number of records written.
+        batch_count: Number of batches written.
+        drop_count: Number of records dropped.
+    '''
+
+    def __init__(self, batch_size=64, flush_interval=0.5, max_queue=10000):
+        '''
+        Args:
+            batch_size(int): Records per write.
+            flush_interval(float): Maximum delay of a record in seconds.
+            max_queue(int): Maximum number of records waiting.
+        '''
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max(self.batch_size, max_queue)
+        self.records = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.record_count = 0
+        self.batch_count = 0
+        self.drop_count = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        '''Queue a record, a dict which NumPy arrays and scalars may be part of.'''
+        with self.cond:
+            if self.closed:
+                return
+            if len(self.records) >= self.max_queue:
+                self.records.popleft()
+                self.drop_count += 1
+            self.records.append(record)
+            # The first record starts the flush interval of its batch
+            if len(self.records) == 1 or len(self.records) >= self.batch_size:
+                self.cond.notify()
+
+    def close(self):
+        '''Write the queued records and close the output.'''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self._close()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.records and not self.closed:
+                    self.cond.wait()
+                if self.records and len(self.records) < self.batch_size \
+                        and not self.closed:
+                    # Give the batch some time to fill up
+                    self.cond.wait_for(
+                        lambda: len(self.records) >= self.batch_size or self.closed,
+                        self.flush_interval)
+                count = min(len(self.records), self.batch_size)
+                batch = [self.records.popleft() for _ in range(count)]
+                if not batch and self.closed:
+                    break
+            if not batch:
+                continue
+
+            lines = ''.join(
+                json.dumps(record, separators=(',', ':'), default=_to_json) + '\n'
+                for record in batch
+            )
+            try:
+                self._write(lines.encode('utf-8'))
+                self.record_count += len(batch)
+                self.batch_count += 1
+            except OSError as e:
+                print('Result sink failed: {}'.format(e), file=sys.stderr)
+                self.drop_count += len(batch)
+
+    def _write(self, data):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class JsonLinesSink(ResultSink):
+    '''Write the results as JSON Lines, one object per frame, into a file
+    or the standard output.
+    '''
+
+    def __init__(self, path='-', **kwargs):
+        '''
+        Args:
+            path(str): Output file, or - for the standard output.
+            kwargs: Batching options of ResultSink.
+        '''
+        if path == '-':
+            self.file = sys.stdout.buffer
+        else:
+            self.file = open(path, 'ab')
+        super().__init__(**kwargs)
+
+    def _write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def _close(self):
+        if self.file is not sys.stdout.buffer:
+            self.file.close()
+
+
+class RotatingJsonLinesSink(ResultSink):
+    '''Write the results as JSON Lines into a file, which is renamed with a
+    .1 suffix when it exceeds max_bytes, the older files being shifted to
+    .2 and so on, up to backup_count files.
+    '''
+
+    def __init__(self, path, max_bytes, backup_count=5, **kwargs):
+        '''
+        Args:
+            path(str): Output file.
+            max_bytes(int): Size from which the file is rotated.
+            backup_count(int): Number of rotated files kept.
+            kwargs: Batching options of ResultSink.
+        '''
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = open(path, 'ab')
+        super().__init__(**kwargs)
+
+    def _write(self, data):
+        if self.file.tell() > 0 and self.file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self.file.write(data)
+        self.file.flush()
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.path, i)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.path, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'ab')
+
+    def _close(self):
+        self.file.close()
+
+
+class SocketSink(ResultSink):
+    '''Send the results as JSON Lines to a local consumer, over a Unix
+    domain socket or TCP. The connection is made again after a failure,
+    the batches sent in between are dropped.
+    '''
+
+    def __init__(self, address, reconnect_interval=1.0, **kwargs):
+        '''
+        Args:
+            address: Path of a Unix domain socket, or (host, port) for TCP.
+            reconnect_interval(float): Minimum delay between the connections.
+            kwargs: Batching options of ResultSink.
+        '''
+        self.address = address
+        self.reconnect_interval = reconnect_interval
+        self.sock = None
+        self.connect_time = None
+        super().__init__(**kwargs)
+
+    def _connect(self):
+        if self.connect_time is not None and \
+                time.monotonic() - self.connect_time < self.reconnect_interval:
+            raise OSError('not connected to {}'.format(self.address))
+        self.connect_time = time.monotonic()
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def _write(self, data):
+        if self.sock is None:
+            self._connect()
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            raise
+
+    def _close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def open_sink(output='-', max_bytes=0, **kwargs):
+    '''Open the result sink for an output specification:
+    - for the standard output, unix:PATH for a Unix domain socket,
+    tcp:HOST:PORT for TCP, else a file, rotated from max_bytes if not 0.
+    '''
+    if output.startswith('unix:'):
+        return SocketSink(output[len('unix:'):], **kwargs)
+    if output.startswith('tcp:'):
+        host, port = output[len('tcp:'):].rsplit(':', 1)
+        return SocketSink((host, int(port)), **kwargs)
+    if output != '-' and max_bytes > 0:
+        return RotatingJsonLinesSink(output, max_bytes, **kwargs)
+    return JsonLinesSink(output, **kwargs)
@@ -28,179 +28,989 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import http.client
+import collections
 import numpy as np
 from attrdict import AttrDict
 
 import tritonclient.http as httpclient
-from tritonclient.utils import InferenceServerException
+import tritonclient.grpc as grpcclient
+from tritonclient.utils import InferenceServerException, triton_to_np_dtype
 import tritonclient.grpc.model_config_pb2 as mc
 
 
-def parse_model(model_metadata, model_config):
+IMAGE_FORMATS = (mc.ModelInput.FORMAT_NCHW, mc.ModelInput.FORMAT_NHWC)
+# Errors of a request besides the ones of the server: the HTTP client raises
+# the errors of the connection as is, for instance once the server is gone
+REQUEST_ERRORS = (InferenceServerException, OSError, http.client.HTTPException)
+
+
+class TensorSpec():
+    '''An input or an output of a model signature.
+
+    Attributes:
+        name: Tensor name.
+        datatype: Triton datatype, such as FP32.
+        shape: Dimensions without the batch dimension, -1 for a variable size.
+        format: ModelInput format of an input, FORMAT_NONE for an output.
+    '''
+
+    def __init__(self, name, datatype, shape, format=mc.ModelInput.FORMAT_NONE):
+        self.name = name
+        self.datatype = datatype
+        self.shape = shape
+        self.format = format
+
+    def is_fixed(self):
+        '''Return True if the size of the tensor is known in advance.'''
+        return self.datatype != 'BYTES' and all(dim >= 0 for dim in self.shape)
+
+    def to_dict(self):
+        return {'name': self.name, 'datatype': self.datatype,
+                'shape': self.shape, 'format': self.format}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['name'], d['datatype'], d['shape'], d['format'])
+
+
+def parse_signature(model_metadata, model_config):
     """
-    Check the configuration of a model to make sure it meets the
-    requirements for an image classification network (as expected by
-    this client)
+    Describe all the inputs and outputs of a model, whatever it does.
+    Returns (max_batch_size, inputs, outputs), where inputs and outputs
+    are lists of TensorSpec in the order of the metadata. The shapes do
+    not include the batch dimension of a model with dynamic batching.
     """
-    if len(model_metadata.inputs) != 1:
-        raise Exception("expecting 1 input, got {}".format(
-            len(model_metadata.inputs)))
-    if len(model_metadata.outputs) != 1:
-        raise Exception("expecting 1 output, got {}".format(
-            len(model_metadata.outputs)))
-
-    if len(model_config.input) != 1:
-        raise Exception(
-            "expecting 1 input in model configuration, got {}".format(
-                len(model_config.input)))
+    batch_dim = (model_config.max_batch_size > 0)
+
+    FORMAT_ENUM_TO_INT = dict(mc.ModelInput.Format.items())
+    formats = {}
+    for input_config in model_config.input:
+        # Left out of the HTTP configuration of some servers when not set
+        format = getattr(input_config, 'format', mc.ModelInput.FORMAT_NONE)
+        if type(format) == str:
+            format = FORMAT_ENUM_TO_INT[format]
+        formats[input_config.name] = format
+
+    def tensors(metadata, kind):
+        specs = []
+        for tensor in metadata:
+            shape = [int(dim) for dim in tensor.shape]
+            if batch_dim:
+                if not shape:
+                    raise Exception(
+                        "expecting a batch dimension, model '{}' {} {} has none".
+                        format(model_metadata.name, kind, tensor.name))
+                shape = shape[1:]
+            specs.append(TensorSpec(
+                tensor.name, tensor.datatype, shape,
+                formats.get(tensor.name, mc.ModelInput.FORMAT_NONE)))
+        return specs
+
+    return (model_config.max_batch_size,
+            tensors(model_metadata.inputs, 'input'),
+            tensors(model_metadata.outputs, 'output'))
 
-    input_metadata = model_metadata.inputs[0]
-    input_config = model_config.input[0]
-    output_metadata = model_metadata.outputs[0]
 
-    if output_metadata.datatype != "FP32":
+def parse_model(model_metadata, model_config):
+    """
+    Check the configuration of a model to make sure it meets the
+    requirements for an image network (as expected by this client):
+    an NCHW or NHWC image input, the first one if there are several, and
+    an FP32 first output. The other inputs and outputs are described by
+    parse_signature.
+    """
+    max_batch_size, inputs, outputs = parse_signature(
+        model_metadata, model_config)
+    if not inputs:
+        raise Exception("expecting at least 1 input, got 0")
+    if not outputs:
+        raise Exception("expecting at least 1 output, got 0")
+
+    # The image is the only input, or the first one in an image format
+    input_spec = inputs[0]
+    if len(inputs) > 1:
+        images = [spec for spec in inputs
+                  if spec.format in IMAGE_FORMATS and len(spec.shape) == 3]
+        if not images:
+            raise Exception(
+                "expecting an NCHW or NHWC image input, model '{}' has none".
+                format(model_metadata.name))
+        input_spec = images[0]
+    output_spec = outputs[0]
+
+    if output_spec.datatype != "FP32":
         raise Exception("expecting output datatype to be FP32, model '" +
                         model_metadata.name + "' output type is " +
-                        output_metadata.datatype)
-
-    # Output is expected to be a vector. But allow any number of
-    # dimensions as long as all but 1 is size 1 (e.g. { 10 }, { 1, 10
-    # }, { 10, 1, 1 } are all ok). Ignore the batch dimension if there
-    # is one.
-    # output_batch_dim = (model_config.max_batch_size > 0)
-    # non_one_cnt = 0
-    # for dim in output_metadata.shape:
-    #     if output_batch_dim:
-    #         output_batch_dim = False
-    #     elif dim > 1:
-    #         non_one_cnt += 1
-    #         if non_one_cnt > 1:
-    #             raise Exception("expecting model output to be a vector")
+                        output_spec.datatype)
 
     # Model input must have 3 dims, either CHW or HWC (not counting
-    # the batch dimension), either CHW or HWC
-    input_batch_dim = (model_config.max_batch_size > 0)
+    # the batch dimension)
+    input_batch_dim = (max_batch_size > 0)
     expected_input_dims = 3 + (1 if input_batch_dim else 0)
-    if len(input_metadata.shape) != expected_input_dims:
+    if len(input_spec.shape) != 3:
         raise Exception(
             "expecting input to have {} dimensions, model '{}' input has {}".
             format(expected_input_dims, model_metadata.name,
-                   len(input_metadata.shape)))
-
-    if type(input_config.format) == str:
-        FORMAT_ENUM_TO_INT = dict(mc.ModelInput.Format.items())
-        input_config.format = FORMAT_ENUM_TO_INT[input_config.format]
+                   len(input_spec.shape) + (1 if input_batch_dim else 0)))
 
-    if ((input_config.format != mc.ModelInput.FORMAT_NCHW) and
-        (input_config.format != mc.ModelInput.FORMAT_NHWC)):
+    if input_spec.format not in IMAGE_FORMATS:
         raise Exception("unexpected input format " +
-                        mc.ModelInput.Format.Name(input_config.format) +
+                        mc.ModelInput.Format.Name(input_spec.format) +
                         ", expecting " +
                         mc.ModelInput.Format.Name(mc.ModelInput.FORMAT_NCHW) +
                         " or " +
                         mc.ModelInput.Format.Name(mc.ModelInput.FORMAT_NHWC))
 
-    if input_config.format == mc.ModelInput.FORMAT_NHWC:
-        h = input_metadata.shape[1 if input_batch_dim else 0]
-        w = input_metadata.shape[2 if input_batch_dim else 1]
-        c = input_metadata.shape[3 if input_batch_dim else 2]
+    if input_spec.format == mc.ModelInput.FORMAT_NHWC:
+        h, w, c = input_spec.shape
     else:
-        c = input_metadata.shape[1 if input_batch_dim else 0]
-        h = input_metadata.shape[2 if input_batch_dim else 1]
-        w = input_metadata.shape[3 if input_batch_dim else 2]
+        c, h, w = input_spec.shape
 
-    return (model_config.max_batch_size, input_metadata.name,
-            output_metadata.name, c, h, w, input_config.format,
-            input_metadata.datatype)
+    return (max_batch_size, input_spec.name, output_spec.name, c, h, w,
+            input_spec.format, input_spec.datatype)
+
+
+def batch_item(output, index):
+    '''Index or slice the batch axis of what TritonClient.get_results
+    returned, a single array or a list of arrays.
+    '''
+    if isinstance(output, list):
+        return [array[index] for array in output]
+    return output[index]
 
 
 class TritonClientError(Exception):
     pass
 
 
+# Backoff between the readiness checks of a server starting up, in seconds
+SERVER_POLL_INTERVAL_MIN = 0.1
+SERVER_POLL_INTERVAL_MAX = 2.0
+MODEL_CACHE_DIR_DEFAULT = os.path.join(
+    os.path.expanduser('~'), '.cache', 'triton_client_examples')
+MODEL_CACHE_TTL_DEFAULT = 24 * 60 * 60
+# Fields of a model signature, as set on a TritonClient by load_model
+SIGNATURE_FIELDS = ['max_batch_size', 'input_name', 'output_name',
+                    'c', 'h', 'w', 'format', 'dtype', 'inputs', 'outputs']
+
+
+def resolve_version(model_metadata, model_version=''):
+    '''Return the version of a model which serves the requests for
+    model_version: model_version itself, or for the latest, the highest
+    version of the model metadata.
+    '''
+    if model_version:
+        return str(model_version)
+    versions = list(getattr(model_metadata, 'versions', None) or [])
+    if not versions:
+        return ''
+    return max(versions, key=lambda version: int(version) if version.isdigit() else -1)
+
+
+class ModelCache():
+    '''An on-disk cache of the parsed model signatures, keyed by server URL,
+    model name and version, so that a client starting again reads the
+    signature of its model instead of fetching and parsing the configuration.
+    An entry records the version of the model it was parsed from, and is
+    only used while the server serves the same version, so that a new
+    version of the model invalidates it. It also expires after ttl seconds,
+    in case the model was replaced by another one with the same name and
+    version.
+
+    There is a JSON file per entry, replaced atomically, so that many
+    processes can share the directory.
+
+    Attributes:
+        directory: Directory of the entries.
+        ttl: Lifetime of an entry in seconds, None for no expiry.
+    '''
+
+    VERSION = 3
+
+    def __init__(self, directory=MODEL_CACHE_DIR_DEFAULT, ttl=MODEL_CACHE_TTL_DEFAULT):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, url, model_name, model_version):
+        key = json.dumps([self.VERSION, url, model_name, model_version])
+        return os.path.join(
+            self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url, model_name, model_version, resolved_version):
+        '''Return the signature of a model as a dict, or None if it is not
+        in the cache, was parsed from another version than resolved_version,
+        the version the server now serves, or has expired.
+        '''
+        try:
+            with open(self._path(url, model_name, model_version)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != [url, model_name, model_version]:
+            return None
+        if entry.get('resolved_version') != resolved_version:
+            return None
+        if self.ttl is not None and time.time() - entry.get('time', 0) > self.ttl:
+            return None
+        return entry.get('signature')
+
+    def put(self, url, model_name, model_version, resolved_version, signature):
+        path = self._path(url, model_name, model_version)
+        entry = {
+            'key': [url, model_name, model_version],
+            'resolved_version': resolved_version,
+            'time': time.time(),
+            'signature': signature,
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            # The cache only saves time, the client works without it
+            print('Could not write the model cache: {}'.format(e), file=sys.stderr)
+
+
+PROTOCOLS = ['http', 'grpc']
+
+
+def parse_url(url, protocol=None):
+    '''Split a server URL into the protocol and the address expected by the
+    Triton clients. The protocol is taken from the URL scheme if any
+    (http:// or grpc://), else from the protocol argument, else HTTP.
+    '''
+    for scheme in PROTOCOLS:
+        prefix = scheme + '://'
+        if url.startswith(prefix):
+            if protocol is not None and protocol != scheme:
+                raise TritonClientError(
+                    'URL scheme {} conflicts with protocol {}'.format(scheme, protocol))
+            return scheme, url[len(prefix):]
+    if protocol is None:
+        protocol = 'http'
+    if protocol not in PROTOCOLS:
+        raise TritonClientError('unsupported protocol {}'.format(protocol))
+    return protocol, url
+
+
+class _AsyncRequest():
+    '''Handle of a gRPC request completed by a callback, with the same
+    get_result interface as the HTTP async_infer handle.
+    '''
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def set_result(self, result, error):
+        self.result = result
+        self.error = error
+        self.event.set()
+
+    def get_result(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class _InputSlot():
+    '''An entry of the input pool: a preallocated image buffer with its
+    batched tensor view and reusable request objects. In shared memory mode,
+    the buffer lives in the input region of the slot, and the slot also owns
+    an output region per requested output. A slot is busy from the time its
+    buffer is handed out until the server no longer reads it.
+    '''
+
+    def __init__(self, image, tensor, infer_input):
+        self.image = image
+        self.tensor = tensor
+        self.infer_input = infer_input
+        self.busy = False
+        self.shm_infer_input = None
+        self.shm_outputs = []
+        self.shm_output_handles = []
+
+
 class TritonClient():
 
-    def __init__(self, url='localhost:8000'):
-        self.request = None
-        self.response = None
+    def __init__(self, url='localhost:8000', max_inflight=1, input_pool_size=None,
+                 protocol=None, stream=False, shared_memory=False):
+        self.protocol, url = parse_url(url, protocol)
+        if self.protocol == 'grpc':
+            self.protocol_client = grpcclient
+        else:
+            self.protocol_client = httpclient
+        if stream and self.protocol != 'grpc':
+            raise TritonClientError('streaming requires the gRPC protocol')
+        self.stream = stream
+        self.stream_requests = {}
+        self.stream_lock = threading.Lock()
 
+        self.response = None
+        # Requests submitted to the server and not yet returned, oldest first
+        self.max_inflight = max(1, max_inflight)
+        self.pending_requests = collections.deque()
+        # Responses received while waiting for a free slot in the window
+        self.completed_responses = collections.deque()
+        self.request_count = 0
+        if input_pool_size is None:
+            input_pool_size = self.max_inflight + 1
+        self.input_pool_size = input_pool_size
+        self.input_buffers = []
+        self.input_pool_index = 0
+        # Next buffer of acquire_input_buffer, ahead of input_pool_index
+        self.acquire_index = 0
+        # Guards the busy flags, set by the preprocessing thread and cleared
+        # by the inference thread
+        self.pool_lock = threading.Lock()
+        self.requested_outputs = {}
+        # System shared memory regions, only for a server on the same host
+        self.shared_memory = shared_memory
+        self.shm_regions = []
+        # Debug stats of the submission path
+        self.input_allocations = 0
+        self.output_allocations = 0
+
+        self.url = url
+        # The gevent based HTTP client only runs in the thread which created
+        # it, so each thread gets its own, by thread ID. The gRPC client is
+        # shared by all the threads.
+        self.http_clients = {}
+        self.grpc_client = None
+        if self.protocol == 'grpc':
+            self.grpc_client = self._create_client()
+            if self.stream:
+                self.grpc_client.start_stream(callback=self._stream_callback)
+        else:
+            self.http_clients[threading.get_ident()] = self._create_client()
+
+    def _create_client(self):
         try:
-            self.client = httpclient.InferenceServerClient(
-                url=url, verbose=False, concurrency=1
+            if self.protocol == 'grpc':
+                return grpcclient.InferenceServerClient(
+                    url=self.url, verbose=False
+                )
+            return httpclient.InferenceServerClient(
+                url=self.url, verbose=False, concurrency=self.max_inflight
             )
         except Exception as e:
-            print('could not create client: {}'.format(e))
+            print('could not create client: {}'.format(e), file=sys.stderr)
             raise TritonClientError(str(e))
 
-    def load_model(self, model_name='inception_graphdef', model_version=''):
-        try:
-            self.client.load_model(model_name)
-        except InferenceServerException as e:
-            print('Could not load the model: {}'.format(e))
-            raise TritonClientError(str(e))
+    @property
+    def client(self):
+        '''The protocol client for the calling thread. The requests of an
+        HTTP client must be submitted and collected in the same thread.
+        '''
+        if self.grpc_client is not None:
+            return self.grpc_client
+        ident = threading.get_ident()
+        client = self.http_clients.get(ident)
+        if client is None:
+            client = self._create_client()
+            self.http_clients[ident] = client
+        return client
+
+    def close(self):
+        self._release_shared_memory()
+        if self.grpc_client is not None:
+            if self.stream:
+                self.grpc_client.stop_stream()
+            self.grpc_client.close()
+        for client in self.http_clients.values():
+            client.close()
+        self.http_clients = {}
+
+    def _stream_callback(self, result, error):
+        with self.stream_lock:
+            if result is not None:
+                request = self.stream_requests.pop(result.get_response().id, None)
+            elif self.stream_requests:
+                # Errors do not carry the request ID, fail the oldest request
+                request = self.stream_requests.pop(min(self.stream_requests, key=int))
+            else:
+                request = None
+        if request is not None:
+            request.set_result(result, error)
+
+    def wait_for_server(self, timeout):
+        '''Wait until the server is ready, checking again with a growing
+        delay, up to timeout seconds. Raises TritonClientError on timeout.
+        '''
+        deadline = time.monotonic() + timeout
+        delay = SERVER_POLL_INTERVAL_MIN
+        while True:
+            try:
+                if self.client.is_server_ready():
+                    return
+            except (InferenceServerException, OSError):
+                # Not listening yet
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TritonClientError(
+                    'server not ready after {} s'.format(timeout))
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, SERVER_POLL_INTERVAL_MAX)
+
+    def load_model(self, model_name='inception_graphdef', model_version='',
+                   cache=None, server_timeout=0, outputs=None):
+        '''Read the signature of a model, loading it first only if it is not
+        ready, as explicit loading needs the explicit model control mode of
+        the server and may reload the model.
+
+        Args:
+            model_name(str): Model name.
+            model_version(str): Model version, empty for the latest.
+            cache(ModelCache): Where the signature is read from, if the model
+                was ready in the version cached, and written to otherwise,
+                None not to cache it. Only the metadata is fetched when the
+                signature comes from the cache, model_config is then None.
+            server_timeout(float): Time to wait for the server to be ready
+                in seconds, 0 not to wait.
+            outputs: Names of the outputs to request, None for all the
+                outputs of the model. get_results returns a list of arrays
+                when there are several.
+        '''
+        if server_timeout > 0:
+            self.wait_for_server(server_timeout)
+
+        loaded = False
+        if not self._is_model_ready(model_name, model_version):
+            try:
+                self.client.load_model(model_name)
+            except InferenceServerException as e:
+                print('Could not load the model: {}'.format(e), file=sys.stderr)
+                raise TritonClientError(str(e))
+            if not self._is_model_ready(model_name, model_version):
+                raise TritonClientError('model loading failure')
+            loaded = True
+
+        cache_url = '{}://{}'.format(self.protocol, self.url)
+        signature = None
+        model_metadata = None
+        if cache is not None:
+            model_metadata = self._fetch_metadata(model_name, model_version)
+            self.resolved_version = resolve_version(model_metadata, model_version)
+            if not loaded:
+                # A model which had to be loaded may have changed since cached
+                signature = cache.get(
+                    cache_url, model_name, model_version, self.resolved_version)
+        if signature is not None:
+            print('Model signature read from the cache', file=sys.stderr)
+            self.model_metadata = model_metadata
+            self.model_config = None
+        else:
+            signature = self._fetch_signature(model_name, model_version, model_metadata)
+            self.resolved_version = resolve_version(self.model_metadata, model_version)
+            if cache is not None:
+                cache.put(cache_url, model_name, model_version,
+                          self.resolved_version, signature)
+        self.model_name = model_name
+        self.model_version = model_version
 
-        if not self.client.is_model_ready(model_name):
-            raise TritonClientError('model loading failure')
+        for field in SIGNATURE_FIELDS:
+            setattr(self, field, signature[field])
+        self.inputs = [TensorSpec.from_dict(d) for d in self.inputs]
+        self.outputs = [TensorSpec.from_dict(d) for d in self.outputs]
+        # Inputs given to infer besides the image
+        self.other_inputs = [
+            spec for spec in self.inputs if spec.name != self.input_name]
+        if outputs is None:
+            self.requested_specs = self.outputs
+        else:
+            specs = {spec.name: spec for spec in self.outputs}
+            for name in outputs:
+                if name not in specs:
+                    raise TritonClientError(
+                        'model {} has no output {}'.format(model_name, name))
+            self.requested_specs = [specs[name] for name in outputs]
+        self.output_name = self.requested_specs[0].name
+        print('max_batch_size: {}'.format(self.max_batch_size), file=sys.stderr)
+        print('input_name    : {}'.format(self.input_name), file=sys.stderr)
+        print('output_name   : {}'.format(self.output_name), file=sys.stderr)
+        print('C             : {}'.format(self.c), file=sys.stderr)
+        print('h             : {}'.format(self.h), file=sys.stderr)
+        print('w             : {}'.format(self.w), file=sys.stderr)
+        print('format        : {}'.format(self.format), file=sys.stderr)
+        print('dtype         : {}'.format(self.dtype), file=sys.stderr)
+        if self.other_inputs:
+            print('other inputs  : {}'.format(
+                ', '.join(spec.name for spec in self.other_inputs)), file=sys.stderr)
+        if len(self.requested_specs) > 1:
+            print('outputs       : {}'.format(
+                ', '.join(spec.name for spec in self.requested_specs)), file=sys.stderr)
+
+        self._allocate_input_pool()
+
+    def _is_model_ready(self, model_name, model_version):
+        try:
+            return self.client.is_model_ready(model_name, model_version)
+        except InferenceServerException:
+            return False
 
+    def _fetch_metadata(self, model_name, model_version):
         try:
             model_metadata = self.client.get_model_metadata(
                 model_name=model_name, model_version=model_version
             )
         except InferenceServerException as e:
-            print('Could not retrive metadata: {}'.format(e))
+            print('Could not retrive metadata: {}'.format(e), file=sys.stderr)
             raise TritonClientError(str(e))
+        if self.protocol == 'grpc':
+            # The gRPC client returns protobuf messages, which parse_model reads as is
+            return model_metadata
+        return AttrDict(model_metadata)
+
+    def _fetch_signature(self, model_name, model_version, model_metadata=None):
+        if model_metadata is None:
+            model_metadata = self._fetch_metadata(model_name, model_version)
 
         try:
             model_config = self.client.get_model_config(
                 model_name=model_name, model_version=model_version
             )
         except InferenceServerException as e:
-            print('Could not retrive config: {}'.format(e))
+            print('Could not retrive config: {}'.format(e), file=sys.stderr)
             raise TritonClientError(str(e))
 
-        self.model_metadata = AttrDict(model_metadata)
-        self.model_config = AttrDict(model_config)
-        self.model_name = model_name
-        self.model_version = model_version
+        self.model_metadata = model_metadata
+        if self.protocol == 'grpc':
+            self.model_config = model_config.config
+        else:
+            self.model_config = AttrDict(model_config)
 
-        self.max_batch_size, self.input_name, self.output_name, \
-        self.c, self.h, self.w, self.format, self.dtype = parse_model(
-            self.model_metadata, self.model_config
-        )
-        print('max_batch_size: {}'.format(self.max_batch_size))
-        print('input_name    : {}'.format(self.input_name))
-        print('output_name   : {}'.format(self.output_name))
-        print('C             : {}'.format(self.c))
-        print('h             : {}'.format(self.h))
-        print('w             : {}'.format(self.w))
-        print('format        : {}'.format(self.format))
-        print('dtype         : {}'.format(self.dtype))
-
-    def infer(self, image, class_count=0):
+        try:
+            fields = parse_model(self.model_metadata, self.model_config)
+            _, inputs, outputs = parse_signature(self.model_metadata, self.model_config)
+        except Exception as e:
+            print('Unsupported model: {}'.format(e), file=sys.stderr)
+            raise TritonClientError(str(e))
+        return dict(zip(SIGNATURE_FIELDS, fields + (
+            [spec.to_dict() for spec in inputs], [spec.to_dict() for spec in outputs])))
+
+    def _allocate_input_pool(self):
+        if self.format == mc.ModelInput.FORMAT_NHWC:
+            shape = (self.h, self.w, self.c)
+        else:
+            shape = (self.c, self.h, self.w)
+        if self.max_batch_size > 0:
+            shape = (1,) + shape
+        npdtype = triton_to_np_dtype(self.dtype)
+
+        self._release_shared_memory()
+        self.input_buffers = []
+        for _ in range(self.input_pool_size):
+            tensor = np.zeros(shape, dtype=npdtype)
+            image = tensor[0] if self.max_batch_size > 0 else tensor
+            infer_input = self.protocol_client.InferInput(self.input_name, shape, self.dtype)
+            self.input_buffers.append(_InputSlot(image, tensor, infer_input))
+            self.input_allocations += 1
+        self.input_pool_index = 0
+        self.acquire_index = 0
+        self.requested_outputs = {}
+        self.other_infer_inputs = {}
+
+        if self.shared_memory:
+            try:
+                self._register_shared_memory(shape, npdtype)
+            except Exception as e:
+                # Fall back to sending the tensors in the request body
+                print('Shared memory disabled: {}'.format(e), file=sys.stderr)
+                self.shared_memory = False
+                self._allocate_input_pool()
+                return
+
+        # Batch tensor for infer_batch, with one reusable input per batch size
+        self.batch_buffer = None
+        self.batch_inputs = {}
         if self.max_batch_size > 0:
-            image = image[np.newaxis, :]
+            self.batch_buffer = np.zeros(
+                (self.max_batch_size,) + shape[1:], dtype=npdtype
+            )
+            self.input_allocations += 1
+
+    def _register_shared_memory(self, shape, npdtype):
+        # Imported here as system shared memory is not available everywhere
+        import tritonclient.utils.shared_memory as shm
+
+        output_sizes = []
+        for spec in self.requested_specs:
+            if not spec.is_fixed():
+                raise TritonClientError(
+                    'size of output {} is not fixed'.format(spec.name))
+            output_dtype = triton_to_np_dtype(spec.datatype)
+            output_sizes.append(
+                int(np.prod(spec.shape)) * np.dtype(output_dtype).itemsize)
+        input_size = int(np.prod(shape)) * np.dtype(npdtype).itemsize
+
+        prefix = 'triton_client_{}_{}'.format(os.getpid(), id(self))
+        for i, slot in enumerate(self.input_buffers):
+            regions = []
+            kinds = [('input', input_size)] + [
+                ('output{}'.format(j), size) for j, size in enumerate(output_sizes)]
+            for kind, size in kinds:
+                name = '{}_{}_{}'.format(prefix, kind, i)
+                handle = shm.create_shared_memory_region(name, '/' + name, size)
+                self.shm_regions.append((name, handle))
+                self.client.register_system_shared_memory(name, '/' + name, size)
+                regions.append((name, handle, size))
+
+            # The image buffer is a view of the input region, so preprocessing
+            # writes straight into the memory the server reads
+            name, handle, size = regions[0]
+            slot.tensor = shm.get_contents_as_numpy(handle, npdtype, shape)
+            slot.image = slot.tensor[0] if self.max_batch_size > 0 else slot.tensor
+            slot.shm_infer_input = self.protocol_client.InferInput(
+                self.input_name, shape, self.dtype
+            )
+            slot.shm_infer_input.set_shared_memory(name, size)
+
+            slot.shm_outputs = []
+            slot.shm_output_handles = []
+            for spec, (name, handle, size) in zip(self.requested_specs, regions[1:]):
+                output = self.protocol_client.InferRequestedOutput(spec.name)
+                output.set_shared_memory(name, size)
+                slot.shm_outputs.append(output)
+                slot.shm_output_handles.append(
+                    (handle, triton_to_np_dtype(spec.datatype)))
+
+    def _release_shared_memory(self):
+        if not self.shm_regions:
+            return
+        import tritonclient.utils.shared_memory as shm
+
+        for name, handle in self.shm_regions:
+            try:
+                self.client.unregister_system_shared_memory(name)
+            except InferenceServerException:
+                pass
+            shm.destroy_shared_memory_region(handle)
+        self.shm_regions = []
+
+    def warmup(self, count=1, batch_size=1, class_count=0):
+        '''Send count requests with a blank input and wait for them, so that
+        the first frames do not pay for the connection setup and the lazy
+        initialization of the model on the server.
+
+        Args:
+            count(int): Number of requests.
+            batch_size(int): Images per request, to warm up batched requests.
+            class_count(int): Number of classes requested per image.
+        '''
+        batch_size = min(batch_size, self.max_batch_size)
+        # Blank other inputs, with a size of 1 for the variable dimensions
+        inputs = {
+            spec.name: np.zeros([max(1, dim) for dim in spec.shape],
+                                dtype=triton_to_np_dtype(spec.datatype))
+            for spec in self.other_inputs
+        }
+        for _ in range(count):
+            image = self.get_input_buffer()
+            image.fill(0)
+            if batch_size > 1:
+                self.infer_batch(
+                    [image] * batch_size, class_count,
+                    {name: [array] * batch_size for name, array in inputs.items()})
+            else:
+                self.infer(image, class_count, inputs)
+        while self.has_pending_results():
+            self.get_results(drain=True)
+
+    def get_input_buffer(self):
+        '''Return the next preallocated image buffer of the input pool.
+        Preprocessing can write a frame into it directly, then pass it to infer
+        without any further copy.
+        '''
+        return self.input_buffers[self.input_pool_index].image
+
+    def acquire_input_buffer(self):
+        '''Return a free image buffer of the input pool for preprocessing
+        running in another thread than infer, ahead of it, or None if all the
+        buffers are in use, in which case the frame should be skipped.
+        The buffer stays in use until the server no longer reads it, or until
+        release_input_buffer is called for a frame dropped before infer.
+        Each frame between the preprocessing and the results needs its own
+        buffer, so the input pool should have max_inflight buffers plus one
+        per frame between the preprocessing and infer.
+        '''
+        with self.pool_lock:
+            for offset in range(len(self.input_buffers)):
+                index = (self.acquire_index + offset) % len(self.input_buffers)
+                slot = self.input_buffers[index]
+                if not slot.busy:
+                    slot.busy = True
+                    self.acquire_index = (index + 1) % len(self.input_buffers)
+                    return slot.image
+        return None
+
+    def release_input_buffer(self, image):
+        '''Give back a buffer of acquire_input_buffer whose frame was dropped
+        before infer. Images which are not buffers of the pool are ignored.
+        '''
+        for slot in self.input_buffers:
+            if image is slot.image:
+                self._release_slot(slot)
+                break
+
+    def _release_slot(self, slot):
+        if slot is not None:
+            with self.pool_lock:
+                slot.busy = False
+
+    def _claim_slot(self):
+        # A free slot from input_pool_index on, for an image which is not a
+        # buffer of the pool, or None if all of them are in use
+        with self.pool_lock:
+            for offset in range(len(self.input_buffers)):
+                index = (self.input_pool_index + offset) % len(self.input_buffers)
+                slot = self.input_buffers[index]
+                if not slot.busy:
+                    slot.busy = True
+                    self.input_pool_index = index
+                    return slot
+        return None
+
+    def _get_requested_outputs(self, class_count):
+        outputs = self.requested_outputs.get(class_count)
+        if outputs is None:
+            outputs = []
+            for spec in self.requested_specs:
+                if self.protocol == 'http':
+                    # Ask for binary outputs explicitly, JSON would have to be parsed
+                    output = httpclient.InferRequestedOutput(
+                        spec.name, binary_data=True, class_count=class_count
+                    )
+                else:
+                    output = grpcclient.InferRequestedOutput(
+                        spec.name, class_count=class_count
+                    )
+                outputs.append(output)
+                self.output_allocations += 1
+            self.requested_outputs[class_count] = outputs
+        return outputs
+
+    def _get_other_inputs(self, inputs, batch_size=None):
+        # The inputs of the model besides the image, from arrays by name
+        if not self.other_inputs and not inputs:
+            return []
+        names = [spec.name for spec in self.other_inputs]
+        if sorted(inputs or {}) != sorted(names):
+            raise TritonClientError('expecting inputs {} besides {}, got {}'.format(
+                names, self.input_name, sorted(inputs or {})))
+
+        infer_inputs = []
+        for spec in self.other_inputs:
+            npdtype = triton_to_np_dtype(spec.datatype)
+            if batch_size is None:
+                tensor = np.asarray(inputs[spec.name], dtype=npdtype)
+                if self.max_batch_size > 0:
+                    tensor = tensor[np.newaxis, :]
+            else:
+                tensor = np.stack(
+                    [np.asarray(value, dtype=npdtype) for value in inputs[spec.name]])
+            key = (spec.name, tensor.shape)
+            infer_input = self.other_infer_inputs.get(key)
+            if infer_input is None:
+                infer_input = self.protocol_client.InferInput(
+                    spec.name, tensor.shape, spec.datatype
+                )
+                self.other_infer_inputs[key] = infer_input
+                self.input_allocations += 1
+            infer_input.set_data_from_numpy(tensor)
+            infer_inputs.append(infer_input)
+        return infer_inputs
+
+    def infer(self, image, class_count=0, inputs=None):
+        '''Submit an image in a request.
+
+        Args:
+            image: Preprocessed image, a buffer of get_input_buffer or
+                acquire_input_buffer, or not.
+            class_count(int): Number of classes to return per image.
+            inputs(dict): Arrays of the other inputs of the model by name,
+                without the batch dimension as the image.
+        '''
+        other_inputs = self._get_other_inputs(inputs)
+        slot = None
+        for index, other in enumerate(self.input_buffers):
+            if image is other.image:
+                # A buffer of get_input_buffer, or acquired ahead
+                self.input_pool_index = index
+                slot = other
+                with self.pool_lock:
+                    slot.busy = True
+                break
+        if slot is None and self.shared_memory:
+            # Copied into the input region of a free slot, if any
+            slot = self._claim_slot()
+        if slot is not None:
+            self.input_pool_index = (self.input_pool_index + 1) % len(self.input_buffers)
+
+        if slot is not None and slot.shm_infer_input is not None:
+            # Shared memory: only the region names go over the wire, the slot
+            # stays busy until get_results returns its output
+            if image is not slot.image:
+                np.copyto(slot.image, image)
+            if class_count == 0:
+                self._submit([slot.shm_infer_input] + other_inputs,
+                             slot.shm_outputs, slot, True)
+            else:
+                # The size of the classification strings is not known in
+                # advance, only the outputs come back in the response
+                self._submit([slot.shm_infer_input] + other_inputs,
+                             self._get_requested_outputs(class_count), slot)
+            return
+
+        if slot is not None:
+            tensor = slot.tensor
+            infer_input = slot.infer_input
+        else:
+            # The image is not a pool buffer, send it as is
+            tensor = image[np.newaxis, :] if self.max_batch_size > 0 else image
+            infer_input = self.input_buffers[self.input_pool_index].infer_input
+            if tuple(tensor.shape) != tuple(infer_input.shape()):
+                infer_input = self.protocol_client.InferInput(
+                    self.input_name, tensor.shape, self.dtype
+                )
+                self.input_allocations += 1
+        infer_input.set_data_from_numpy(tensor)
+        # The tensor is copied into the request, the buffer is free again
+        self._release_slot(slot)
+
+        self._submit([infer_input] + other_inputs, self._get_requested_outputs(class_count))
+
+    def infer_batch(self, images, class_count=0, inputs=None):
+        '''Submit several images in a single request.
+        The result returned by get_results has one row per image.
+
+        Args:
+            images: Sequence of preprocessed images, at most max_batch_size.
+            class_count(int): Number of classes to return per image.
+            inputs(dict): Sequences of arrays of the other inputs of the model
+                by name, one per image.
+        '''
+        batch_size = len(images)
+        if self.max_batch_size <= 0 or batch_size > self.max_batch_size:
+            raise TritonClientError(
+                'batch of {} exceeds max_batch_size {}'.format(
+                    batch_size, self.max_batch_size))
+        other_inputs = self._get_other_inputs(inputs, batch_size)
+
+        tensor = self.batch_buffer[:batch_size]
+        np.stack(images, out=tensor)
+
+        infer_input = self.batch_inputs.get(batch_size)
+        if infer_input is None:
+            infer_input = self.protocol_client.InferInput(
+                self.input_name, tensor.shape, self.dtype
+            )
+            self.batch_inputs[batch_size] = infer_input
+            self.input_allocations += 1
+        infer_input.set_data_from_numpy(tensor)
 
-        inputs = [httpclient.InferInput(self.input_name, image.shape, self.dtype)]
-        inputs[0].set_data_from_numpy(image)
+        self._submit([infer_input] + other_inputs, self._get_requested_outputs(class_count))
 
-        outputs = [httpclient.InferRequestedOutput(self.output_name, class_count=class_count)]
+    def _submit(self, inputs, outputs, slot=None, shm_outputs=False):
+        # Back-pressure: wait for the oldest request when the window is full
+        if len(self.pending_requests) >= self.max_inflight:
+            self.completed_responses.append(self._wait_oldest())
 
+        request_id = str(self.request_count)
         try:
-            self.request = self.client.async_infer(
-                self.model_name, inputs, request_id='0',
-                model_version=self.model_version, outputs=outputs
-            )
-        except InferenceServerException as e:
-            print('Inference failed: {}'.format(e))
+            if self.protocol == 'http':
+                request = self.client.async_infer(
+                    self.model_name, inputs, request_id=request_id,
+                    model_version=self.model_version, outputs=outputs
+                )
+            elif self.stream:
+                request = _AsyncRequest()
+                with self.stream_lock:
+                    self.stream_requests[request_id] = request
+                self.client.async_stream_infer(
+                    self.model_name, inputs, request_id=request_id,
+                    model_version=self.model_version, outputs=outputs
+                )
+            else:
+                request = _AsyncRequest()
+                self.client.async_infer(
+                    self.model_name, inputs, request.set_result,
+                    request_id=request_id,
+                    model_version=self.model_version, outputs=outputs
+                )
+        except REQUEST_ERRORS as e:
+            with self.stream_lock:
+                self.stream_requests.pop(request_id, None)
+            self._release_slot(slot)
+            print('Inference failed: {}'.format(e), file=sys.stderr)
+            raise TritonClientError(str(e))
+        self.request_count += 1
+        self.pending_requests.append((request, slot, shm_outputs))
+
+    def _wait_oldest(self):
+        request, slot, shm_outputs = self.pending_requests.popleft()
+        try:
+            return request.get_result(), slot, shm_outputs
+        except REQUEST_ERRORS as e:
+            self._release_slot(slot)
+            print('Inference failed: {}'.format(e), file=sys.stderr)
             raise TritonClientError(str(e))
 
-    def get_results(self):
-        if self.request is None:
+    def get_results(self, drain=False):
+        '''Return the output of the oldest request, in submission order, or a
+        list of outputs in the order of the requested outputs if there are
+        several, all from the same response.
+        To keep the server busy, None is returned until max_inflight requests
+        are in flight, unless drain is True, which is meant to collect the
+        remaining requests at the end of a stream.
+        '''
+        if self.completed_responses:
+            self.response, slot, shm_outputs = self.completed_responses.popleft()
+        elif len(self.pending_requests) >= self.max_inflight or \
+                (drain and self.pending_requests):
+            self.response, slot, shm_outputs = self._wait_oldest()
+        else:
             return None
 
-        self.response = self.request.get_result()
-        output_array = self.response.as_numpy(self.output_name)
+        if shm_outputs:
+            output_arrays = self._shared_memory_outputs(slot)
+        else:
+            output_arrays = [self.response.as_numpy(spec.name)
+                             for spec in self.requested_specs]
+        # The server is done with the input region of the slot
+        self._release_slot(slot)
         if self.max_batch_size <= 0:
-            output_array = output_array[np.newaxis, :]
-
-        return output_array
+            output_arrays = [array[np.newaxis, :] for array in output_arrays]
+
+        if len(output_arrays) == 1:
+            return output_arrays[0]
+        return output_arrays
+
+    def _shared_memory_outputs(self, slot):
+        import tritonclient.utils.shared_memory as shm
+
+        arrays = []
+        for spec, (handle, dtype) in zip(self.requested_specs, slot.shm_output_handles):
+            output = self.response.get_output(spec.name)
+            if isinstance(output, dict):
+                shape = output['shape']
+            else:
+                shape = list(output.shape)
+            # Copied out of the output region, which the next request of the
+            # slot overwrites while the output may still be postprocessed
+            arrays.append(np.array(shm.get_contents_as_numpy(handle, dtype, shape)))
+        return arrays
+
+    def has_pending_results(self):
+        return bool(self.completed_responses or self.pending_requests)
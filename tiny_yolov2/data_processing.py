@@ -47,11 +47,12 @@
 # Users Notice.
 #
 
-import math
 from PIL import Image
 import numpy as np
 import os
 
+from nms import nms
+
 
 # YOLOv3-608 has been trained with these 80 categories from COCO:
 # Lin, Tsung-Yi, et al. "Microsoft COCO: Common Objects in Context."
@@ -61,6 +62,12 @@ def load_label_categories(label_file_path):
     categories = [line.rstrip('\n') for line in open(label_file_path)]
     return categories
 
+
+def _sigmoid(value):
+    """Return the element-wise sigmoid of a NumPy array."""
+    return 1.0 / (1.0 + np.exp(-value))
+
+
 #LABEL_FILE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'voc.names')
 #ALL_CATEGORIES = load_label_categories(LABEL_FILE_PATH)
 
@@ -142,7 +149,9 @@ class PostprocessYOLO(object):
                  obj_threshold,
                  nms_threshold,
                  yolo_input_resolution,
-                 num_categories
+                 num_categories,
+                 early_reject=True,
+                 max_detections=None
     ):
         """Initialize with all values that will be kept when processing several frames.
         Assuming 3 outputs of the network in the case of (large) YOLOv3.
@@ -155,6 +164,10 @@ class PostprocessYOLO(object):
         float value between 0 and 1
         input_resolution_yolo -- two-dimensional tuple with the target network's (spatial)
         input resolution in HW order
+        num_categories -- number of object categories
+        early_reject -- if True, only decode box geometry and class scores for the cells
+        whose objectness alone can reach the object threshold
+        max_detections -- maximum number of detections returned per frame, or None for no limit
         """
         self.masks = yolo_masks
         self.anchors = yolo_anchors
@@ -163,6 +176,23 @@ class PostprocessYOLO(object):
         self.input_resolution_yolo = yolo_input_resolution
         # Added instance variable for the number of categories
         self.num_categories = num_categories
+        self.early_reject = early_reject
+        self.max_detections = max_detections
+        # A class score is objectness times class probability, so no cell whose objectness
+        # is below the object threshold can survive filtering. Compare the raw logits
+        # against the inverse sigmoid of the threshold to skip the sigmoid entirely.
+        if obj_threshold <= 0.0:
+            self._object_logit_threshold = -np.inf
+        elif obj_threshold >= 1.0:
+            self._object_logit_threshold = np.inf
+        else:
+            # Loosened slightly so rounding never rejects a cell the exact filter would keep
+            self._object_logit_threshold = \
+                np.log(obj_threshold / (1.0 - obj_threshold)) - 1e-6
+        # Decode tensors keyed by (grid_h, grid_w, mask)
+        self._decode_cache = dict()
+        self.decode_cache_hits = 0
+        self.decode_cache_misses = 0
 
     def process(self, outputs, resolution_raw):
         """Take the YOLOv3 outputs generated from a TensorRT forward pass, post-process them
@@ -174,139 +204,130 @@ class PostprocessYOLO(object):
         resolution_raw -- the original spatial resolution from the input PIL image in WH order
         """
 
+        return self.process_batch(outputs, resolution_raw)[0]
+
+    def process_batch(self, outputs, resolution_raw):
+        """Take the YOLOv3 outputs of a batch of N frames, post-process all the frames at once
+        and return a list with the bounding boxes, categories and confidences of each frame.
+        A frame without any detection gets (None, None, None), like in process.
+
+        Keyword arguments:
+        outputs -- outputs from a TensorRT engine in NCHW format
+        resolution_raw -- the original spatial resolution from the input PIL image in WH order,
+        either shared by all the frames or a list with one resolution per frame
+        """
+
         outputs_reshaped = list()
         for output in outputs:
             outputs_reshaped.append(self._reshape_output(output))
 
-        boxes, categories, confidences = self._process_yolo_output(
-            outputs_reshaped, resolution_raw)
-
-        return boxes, categories, confidences
+        return self._process_yolo_output(outputs_reshaped, resolution_raw)
 
     def _reshape_output(self, output):
         """Reshape a TensorRT output from NCHW to NHWC format (with expected C=255),
-        and then return it in (height,width,3,85) dimensionality after further reshaping.
+        and then return it in (N,height,width,3,85) dimensionality after further reshaping.
 
         Keyword argument:
         output -- an output from a TensorRT engine after inference
         """
 
         output = np.transpose(output, [0, 2, 3, 1])
-        _, height, width, _ = output.shape
-        dim1, dim2 = height, width
-        #dim3 = 3
-        # Modified to support various anchor size
-        dim3 = len(self.anchors)
+        batch_size, height, width, _ = output.shape
+        dim0, dim1, dim2 = batch_size, height, width
+        # The number of anchors of this output follows from the channel count
+        dim3 = -1
         # There are CATEGORY_NUM=80 object categories:
         #dim4 = (4 + 1 + CATEGORY_NUM)
         dim4 = (4 + 1 + self.num_categories)
-        return np.reshape(output, (dim1, dim2, dim3, dim4))
+        return np.reshape(output, (dim0, dim1, dim2, dim3, dim4))
 
     def _process_yolo_output(self, outputs_reshaped, resolution_raw):
-        """Take in a list of three reshaped YOLO outputs in (height,width,3,85) shape and return
-        return a list of bounding boxes for detected object together with their category and their
-        confidences in separate lists.
+        """Take in a list of three reshaped YOLO outputs in (N,height,width,3,85) shape and
+        return a list with the bounding boxes for detected object together with their category
+        and their confidences of each of the N frames.
 
         Keyword arguments:
         outputs_reshaped -- list of three reshaped YOLO outputs as NumPy arrays
-        with shape (height,width,3,85)
-        resolution_raw -- the original spatial resolution from the input PIL image in WH order
+        with shape (N,height,width,3,85)
+        resolution_raw -- the original spatial resolution from the input PIL image in WH order,
+        either shared by all the frames or a list with one resolution per frame
         """
 
+        batch_size = outputs_reshaped[0].shape[0]
+
         # E.g. in YOLOv3-608, there are three output tensors, which we associate with their
         # respective masks. Then we iterate through all output-mask pairs and generate candidates
         # for bounding boxes, their corresponding category predictions and their confidences:
-        boxes, categories, confidences = list(), list(), list()
+        frames, boxes, categories, confidences = list(), list(), list(), list()
         for output, mask in zip(outputs_reshaped, self.masks):
-            box, category, confidence = self._process_feats(output, mask)
-            box, category, confidence = self._filter_boxes(box, category, confidence)
+            if self.early_reject:
+                frame, box, category, confidence = self._process_feats_sparse(output, mask)
+            else:
+                box, category, confidence = self._process_feats(output, mask)
+                frame, box, category, confidence = self._filter_boxes(box, category, confidence)
+            frames.append(frame)
             boxes.append(box)
             categories.append(category)
             confidences.append(confidence)
 
+        frames = np.concatenate(frames)
         boxes = np.concatenate(boxes)
         categories = np.concatenate(categories)
         confidences = np.concatenate(confidences)
 
         # Scale boxes back to original image shape:
-        width, height = resolution_raw
-        image_dims = [width, height, width, height]
+        resolution_raw = np.asarray(resolution_raw, dtype=np.float64)
+        if resolution_raw.ndim == 2:
+            resolution_raw = resolution_raw[frames]
+        image_dims = np.tile(resolution_raw, 2)
         boxes = boxes * image_dims
 
-        # Using the candidates from the previous (loop) step, we apply the non-max suppression
-        # algorithm that clusters adjacent bounding boxes to a single bounding box:
-        nms_boxes, nms_categories, nscores = list(), list(), list()
-        for category in set(categories):
-            idxs = np.where(categories == category)
-            box = boxes[idxs]
-            category = categories[idxs]
-            confidence = confidences[idxs]
-
-            keep = self._nms_boxes(box, confidence)
-
-            nms_boxes.append(box[keep])
-            nms_categories.append(category[keep])
-            nscores.append(confidence[keep])
+        results = [(None, None, None)] * batch_size
+        if len(categories) == 0:
+            return results
 
-        if not nms_categories and not nscores:
-            return None, None, None
-
-        boxes = np.concatenate(nms_boxes)
-        categories = np.concatenate(nms_categories)
-        confidences = np.concatenate(nscores)
-
-        return boxes, categories, confidences
+        # Using the candidates from the previous (loop) step, we apply the non-max suppression
+        # algorithm that clusters adjacent bounding boxes to a single bounding box. Each
+        # (frame, category) pair is given its own group, so that boxes are only suppressed by
+        # boxes of the same category in the same frame:
+        groups = frames * self.num_categories + categories
+        top_k = self.max_detections if batch_size == 1 else None
+        keep = nms(boxes, confidences, groups, self.nms_threshold, top_k)
+
+        # Group the kept detections by frame, preserving the descending score order
+        keep = keep[np.argsort(frames[keep], kind='stable')]
+        bounds = np.searchsorted(frames[keep], np.arange(batch_size + 1))
+        for i in range(batch_size):
+            frame_keep = keep[bounds[i]:bounds[i + 1]][:self.max_detections]
+            if len(frame_keep) > 0:
+                results[i] = (
+                    boxes[frame_keep], categories[frame_keep], confidences[frame_keep])
+
+        return results
 
     def _process_feats(self, output_reshaped, mask):
-        """Take in a reshaped YOLO output in height,width,3,85 format together with its
+        """Take in a reshaped YOLO output in N,height,width,3,85 format together with its
         corresponding YOLO mask and return the detected bounding boxes, the confidence,
         and the class probability in each cell/pixel.
 
         Keyword arguments:
-        output_reshaped -- reshaped YOLO output as NumPy arrays with shape (height,width,3,85)
+        output_reshaped -- reshaped YOLO output as NumPy arrays with shape (N,height,width,3,85)
         mask -- 2-dimensional tuple with mask specification for this output
         """
 
-        # Two in-line functions required for calculating the bounding box
-        # descriptors:
-        def sigmoid(value):
-            """Return the sigmoid of the input."""
-            return 1.0 / (1.0 + math.exp(-value))
-
-        def exponential(value):
-            """Return the exponential of the input."""
-            return math.exp(value)
-
-        # Vectorized calculation of above two functions:
-        sigmoid_v = np.vectorize(sigmoid)
-        exponential_v = np.vectorize(exponential)
+        _, grid_h, grid_w, _, _ = output_reshaped.shape
 
-        grid_h, grid_w, _, _ = output_reshaped.shape
+        grid, grid_dims, anchors_tensor = self._get_decode_tensors(grid_h, grid_w, mask)
 
-        anchors = [self.anchors[i] for i in mask]
-
-        # Reshape to N, height, width, num_anchors, box_params:
-        anchors_tensor = np.reshape(anchors, [1, 1, len(anchors), 2])
-        box_xy = sigmoid_v(output_reshaped[..., :2])
-        box_wh = exponential_v(output_reshaped[..., 2:4]) * anchors_tensor * 32.0
-        #box_wh = exponential_v(output_reshaped[..., 2:6]) * anchors_tensor
-        box_confidence = sigmoid_v(output_reshaped[..., 4])
+        box_xy = _sigmoid(output_reshaped[..., :2])
+        box_wh = np.exp(output_reshaped[..., 2:4]) * anchors_tensor
+        box_confidence = _sigmoid(output_reshaped[..., 4])
 
         box_confidence = np.expand_dims(box_confidence, axis=-1)
-        box_class_probs = sigmoid_v(output_reshaped[..., 5:])
-
-        col = np.tile(np.arange(0, grid_w), grid_w).reshape(-1, grid_w)
-        row = np.tile(np.arange(0, grid_h).reshape(-1, 1), grid_h)
-
-        #col = col.reshape(grid_h, grid_w, 1, 1).repeat(3, axis=-2)
-        #row = row.reshape(grid_h, grid_w, 1, 1).repeat(3, axis=-2)
-        col = col.reshape(grid_h, grid_w, 1, 1).repeat(5, axis=-2)
-        row = row.reshape(grid_h, grid_w, 1, 1).repeat(5, axis=-2)
-        grid = np.concatenate((col, row), axis=-1)
+        box_class_probs = _sigmoid(output_reshaped[..., 5:])
 
         box_xy += grid
-        box_xy /= (grid_w, grid_h)
-        box_wh /= self.input_resolution_yolo
+        box_xy /= grid_dims
         box_xy -= (box_wh / 2.)
         boxes = np.concatenate((box_xy, box_wh), axis=-1)
 
@@ -314,16 +335,79 @@ class PostprocessYOLO(object):
         # class confidence
         return boxes, box_confidence, box_class_probs
 
+    def _process_feats_sparse(self, output_reshaped, mask):
+        """Take in a reshaped YOLO output in N,height,width,3,85 format together with its
+        corresponding YOLO mask and return the frame indexes, filtered bounding boxes, classes
+        and scores like _filter_boxes does, but only decode the cells whose objectness passes
+        the object threshold.
+
+        Keyword arguments:
+        output_reshaped -- reshaped YOLO output as NumPy arrays with shape (N,height,width,3,85)
+        mask -- 2-dimensional tuple with mask specification for this output
+        """
+        _, grid_h, grid_w, _, _ = output_reshaped.shape
+
+        grid, grid_dims, anchors_tensor = self._get_decode_tensors(grid_h, grid_w, mask)
+
+        pos = np.nonzero(output_reshaped[..., 4] >= self._object_logit_threshold)
+        feats = output_reshaped[pos]
+
+        box_xy = _sigmoid(feats[:, :2]) + grid[pos[1], pos[2], 0]
+        box_xy /= grid_dims
+        box_wh = np.exp(feats[:, 2:4]) * anchors_tensor[0, 0, pos[3]]
+        box_xy -= (box_wh / 2.)
+        boxes = np.concatenate((box_xy, box_wh), axis=-1)
+
+        box_scores = _sigmoid(feats[:, 4:5]) * _sigmoid(feats[:, 5:])
+        box_classes = np.argmax(box_scores, axis=-1)
+        box_class_scores = np.max(box_scores, axis=-1)
+        keep = np.nonzero(box_class_scores >= self.object_threshold)
+
+        return pos[0][keep], boxes[keep], box_classes[keep], box_class_scores[keep]
+
+    def _get_decode_tensors(self, grid_h, grid_w, mask):
+        """Return the tensors needed to decode an output of the given grid size and mask:
+        the (height,width,1,2) cell offsets, the grid dimensions in WH order and the
+        (1,1,num_anchors,2) anchor sizes already scaled to the input resolution.
+        They do not depend on the frame, so they are built once per key and cached.
+
+        Keyword arguments:
+        grid_h -- number of cells in the vertical direction
+        grid_w -- number of cells in the horizontal direction
+        mask -- tuple with mask specification for this output
+        """
+        key = (grid_h, grid_w, tuple(mask))
+        tensors = self._decode_cache.get(key)
+        if tensors is not None:
+            self.decode_cache_hits += 1
+            return tensors
+
+        self.decode_cache_misses += 1
+        col, row = np.meshgrid(
+            np.arange(grid_w, dtype=np.float32),
+            np.arange(grid_h, dtype=np.float32))
+        grid = np.stack((col, row), axis=-1)[:, :, np.newaxis, :]
+        grid_dims = np.array((grid_w, grid_h), dtype=np.float32)
+
+        # Reshape to height, width, num_anchors, box_params:
+        anchors = np.array([self.anchors[i] for i in mask], dtype=np.float32)
+        anchors_tensor = np.reshape(anchors, [1, 1, len(mask), 2]) * 32.0
+        anchors_tensor /= np.array(self.input_resolution_yolo, dtype=np.float32)
+
+        tensors = (grid, grid_dims, anchors_tensor)
+        self._decode_cache[key] = tensors
+        return tensors
+
     def _filter_boxes(self, boxes, box_confidences, box_class_probs):
         """Take in the unfiltered bounding box descriptors and discard each cell
         whose score is lower than the object threshold set during class initialization.
 
         Keyword arguments:
-        boxes -- bounding box coordinates with shape (height,width,3,4); 4 for
+        boxes -- bounding box coordinates with shape (N,height,width,3,4); 4 for
         x,y,height,width coordinates of the boxes
-        box_confidences -- bounding box confidences with shape (height,width,3,1); 1 for as
+        box_confidences -- bounding box confidences with shape (N,height,width,3,1); 1 for as
         confidence scalar per element
-        box_class_probs -- class probabilities with shape (height,width,3,CATEGORY_NUM)
+        box_class_probs -- class probabilities with shape (N,height,width,3,CATEGORY_NUM)
 
         """
         box_scores = box_confidences * box_class_probs
@@ -331,11 +415,12 @@ class PostprocessYOLO(object):
         box_class_scores = np.max(box_scores, axis=-1)
         pos = np.where(box_class_scores >= self.object_threshold)
 
+        frames = pos[0]
         boxes = boxes[pos]
         classes = box_classes[pos]
         scores = box_class_scores[pos]
 
-        return boxes, classes, scores
+        return frames, boxes, classes, scores
 
     def _nms_boxes(self, boxes, box_confidences):
         """Apply the Non-Maximum Suppression (NMS) algorithm on the bounding boxes with their
@@ -347,37 +432,4 @@ class PostprocessYOLO(object):
         with shape (N,4); 4 for x,y,height,width coordinates of the boxes
         box_confidences -- a Numpy array containing the corresponding confidences with shape N
         """
-        x_coord = boxes[:, 0]
-        y_coord = boxes[:, 1]
-        width = boxes[:, 2]
-        height = boxes[:, 3]
-
-        areas = width * height
-        ordered = box_confidences.argsort()[::-1]
-
-        keep = list()
-        while ordered.size > 0:
-            # Index of the current element:
-            i = ordered[0]
-            keep.append(i)
-            xx1 = np.maximum(x_coord[i], x_coord[ordered[1:]])
-            yy1 = np.maximum(y_coord[i], y_coord[ordered[1:]])
-            xx2 = np.minimum(x_coord[i] + width[i], x_coord[ordered[1:]] + width[ordered[1:]])
-            yy2 = np.minimum(y_coord[i] + height[i], y_coord[ordered[1:]] + height[ordered[1:]])
-
-            width1 = np.maximum(0.0, xx2 - xx1 + 1)
-            height1 = np.maximum(0.0, yy2 - yy1 + 1)
-            intersection = width1 * height1
-            union = (areas[i] + areas[ordered[1:]] - intersection)
-
-            # Compute the Intersection over Union (IoU) score:
-            iou = intersection / union
-
-            # The goal of the NMS algorithm is to reduce the number of adjacent bounding-box
-            # candidates to a minimum. In this step, we keep only those elements whose overlap
-            # with the current bounding box is lower than the threshold:
-            indexes = np.where(iou <= self.nms_threshold)[0]
-            ordered = ordered[indexes + 1]
-
-        keep = np.array(keep)
-        return keep
+        return nms(boxes, box_confidences, None, self.nms_threshold)
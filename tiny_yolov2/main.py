@@ -25,6 +25,9 @@
 import cv2
 import sys
 import os
+import time
+import signal
+import contextlib
 import numpy as np
 import argparse
 import wget
@@ -33,6 +36,12 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 import triton_client
 import preprocess
 import interval_counter
+import multi_stream
+import pipeline
+import process_pool
+import result_sink
+import offline
+import instrumentation
 from data_processing import PostprocessYOLO
 
 
@@ -44,6 +53,18 @@ CAMERA_ID_DEFAULT = 0
 CAPTURE_WIDTH_DEFAULT = 640
 CAPTURE_HEIGHT_DEFAULT = 480
 SERVER_URL_DEFAULT = 'localhost:8000'
+PREPROCESS_BACKENDS = ['pil', 'opencv']
+PREPROCESS_BACKEND_DEFAULT = 'pil'
+MAX_INFLIGHT_DEFAULT = 1
+CONNECTIONS_DEFAULT = 1
+WORKERS_DEFAULT = 0
+OUTPUT_DEFAULT = '-'
+ROTATE_DEFAULT = 0
+BATCH_SIZE_DEFAULT = 0
+METRICS_INTERVAL_DEFAULT = 0
+METRICS_PORT_DEFAULT = 0
+WAIT_SERVER_DEFAULT = 0
+WARMUP_DEFAULT = 1
 LABEL_URL = 'https://raw.githubusercontent.com/pjreddie/darknet/master/data/voc.names'
 LABEL_FILE = os.path.basename(LABEL_URL)
 
@@ -51,16 +72,18 @@ LABEL_FILE = os.path.basename(LABEL_URL)
 def download_file(url, path):
     file = os.path.join(path, os.path.basename(url))
     if not os.path.exists(file):
-        wget.download(url, out=file)
+        # The progress bar goes to stderr too, stdout may carry the results
+        with contextlib.redirect_stdout(sys.stderr):
+            wget.download(url, out=file)
     else:
-        print('{} already exists'.format(file))
+        print('{} already exists'.format(file), file=sys.stderr)
     return file
 
 
 def download_label(path):
     if not os.path.exists(path):
         os.makedirs(path)
-    print('Downloading the label file from {}'.format(LABEL_URL))
+    print('Downloading the label file from {}'.format(LABEL_URL), file=sys.stderr)
     download_file(LABEL_URL, path)
 
 
@@ -95,7 +118,326 @@ def draw_bboxes(image, bboxes, confidences, categories, all_categories):
         info = '{0} {1:.2f}'.format(all_categories[category], score)
         cv2.putText(image, info, (left, top - 8),
                 cv2.FONT_HERSHEY_SIMPLEX, 1, BBOX_COLOR, 1, cv2.LINE_AA)
-        print(info)
+        print(info, file=sys.stderr)
+
+
+def detection_record(sequence, timestamp, boxes, classes, scores, stream=None):
+    '''Make the record of the detections of a frame for the result sink.
+    The boxes are (x, y, width, height) in the frame, rounded to a tenth
+    of a pixel, and the scores to 4 digits, to keep the records compact.
+    '''
+    record = {'frame': sequence, 'time': round(timestamp, 3)}
+    if stream is not None:
+        record['stream'] = stream
+    if boxes is None:
+        record['boxes'], record['classes'], record['scores'] = [], [], []
+        return record
+    # As float64, float32 values are written with spurious digits
+    record['boxes'] = np.round(np.asarray(boxes, dtype=np.float64), 1)
+    record['classes'] = classes
+    record['scores'] = np.round(np.asarray(scores, dtype=np.float64), 4)
+    return record
+
+
+def preprocess_task(context, frame, image, backend, format, dtype, c, h, w):
+    '''Preprocess a frame into the image buffer, in a worker process.'''
+    if backend == 'opencv':
+        preprocess.preprocess_opencv(frame, format, dtype, c, h, w, out=image)
+    else:
+        np.copyto(image, preprocess.preprocess(frame, format, dtype, c, h, w))
+
+
+def postprocess_task(postprocessor, output, _, width, height):
+    '''Postprocess an inference output, in a worker process.'''
+    return postprocessor.process([output], (width, height))
+
+
+def model_cache(args):
+    '''Return the model signature cache of the command line, or None.'''
+    if args.model_cache is None:
+        return None
+    return triton_client.ModelCache(args.model_cache)
+
+
+def run_streams(args, categories, postprocessor, sink, metrics):
+    '''Run the demo on several sources sharing a pool of Triton connections,
+    with a window per source or headless, the results written to the sink
+    if any, and the FPS printed every second.
+    '''
+    try:
+        runner = multi_stream.MultiStreamRunner(
+            args.sources, args.url, MODEL_NAME, connections=args.connections,
+            max_inflight=args.inflight, shared_memory=args.shm,
+            width=args.width, height=args.height, metrics=metrics,
+            model_cache=model_cache(args), server_timeout=args.wait_server,
+            warmup=args.warmup
+        )
+    except triton_client.TritonClientError as e:
+        print(e, file=sys.stderr)
+        sys.exit(-1)
+
+    def preprocess_frame(frame, model):
+        if args.preprocess == 'opencv':
+            return preprocess.preprocess_opencv(
+                frame, model.format, model.dtype, model.c, model.h, model.w
+            )
+        return preprocess.preprocess(
+            frame, model.format, model.dtype, model.c, model.h, model.w
+        )
+
+    def process_results(stream, sequence, frame, results):
+        height, width, _ = frame.shape
+        with metrics.span('postprocess'):
+            boxes, classes, scores = postprocessor.process(
+                [results], (width, height)
+            )
+        if sink is not None:
+            sink.write(detection_record(
+                sequence, time.time(), boxes, classes, scores, stream.index
+            ))
+        if args.headless:
+            return
+        with metrics.span('render'):
+            if boxes is not None:
+                draw_bboxes(frame, boxes, scores, classes, categories)
+            draw_info(frame, stream.interval)
+
+    runner.start(preprocess_frame, process_results)
+    if args.headless:
+        # Ctrl+C stops the sources
+        signal.signal(signal.SIGINT, lambda signum, frame: runner.stop_event.set())
+
+    shown = [None] * len(runner.streams)
+    # The FPS of all the streams are printed by a single thread
+    runner.registry.start_reporter(1.0)
+    while runner.is_running():
+        if args.headless:
+            time.sleep(0.1)
+        else:
+            # Show the newest result of each stream
+            for stream in runner.streams:
+                latest = stream.latest
+                if latest is not None and latest is not shown[stream.index]:
+                    shown[stream.index] = latest
+                    cv2.imshow('{} [{}]'.format(WINDOW_TITLE, stream.index), latest[0])
+
+            # Check if ESC pressed
+            key = cv2.waitKey(1)
+            if key == 27:  # ESC
+                break
+
+    runner.registry.stop_reporter()
+    runner.stop()
+    if runner.error is not None:
+        print(runner.error, file=sys.stderr)
+    if not args.headless:
+        cv2.destroyAllWindows()
+
+
+def run_offline(args, postprocessor, sink, metrics):
+    '''Run the demo on video files and image directories as fast as the
+    server allows, in batches, with the results written to the sink and
+    the throughput printed at the end.
+    '''
+    client = triton_client.TritonClient(
+        url=args.url, max_inflight=args.inflight, shared_memory=args.shm
+    )
+    try:
+        client.load_model(model_name=MODEL_NAME, cache=model_cache(args),
+                          server_timeout=args.wait_server)
+    except triton_client.TritonClientError as e:
+        print(e, file=sys.stderr)
+        sys.exit(-1)
+
+    def preprocess_frame(frame):
+        if args.preprocess == 'opencv':
+            return preprocess.preprocess_opencv(
+                frame, client.format, client.dtype, client.c, client.h, client.w
+            )
+        return preprocess.preprocess(
+            frame, client.format, client.dtype, client.c, client.h, client.w
+        )
+
+    def process_results(frames, results):
+        # The frames of a batch are postprocessed at once
+        resolutions = [(frame.frame.shape[1], frame.frame.shape[0]) for frame in frames]
+        with metrics.span('postprocess'):
+            detections = postprocessor.process_batch([results], resolutions)
+        for frame, (boxes, classes, scores) in zip(frames, detections):
+            record = detection_record(
+                frame.index, time.time(), boxes, classes, scores
+            )
+            record['source'] = frame.source
+            sink.write(record)
+
+    reader = offline.FrameReader(args.offline, preprocess_frame, metrics=metrics)
+    runner = offline.OfflineRunner(client, args.batch, metrics=metrics)
+    try:
+        client.warmup(args.warmup, batch_size=runner.batch_size)
+        runner.run(reader, process_results)
+    except triton_client.TritonClientError as e:
+        print(e, file=sys.stderr)
+        sys.exit(-1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+        client.close()
+    # Not to the standard output, which may carry the results
+    print(runner.report(), file=sys.stderr)
+    if reader.failed:
+        print('{} of the {} files could not be read'.format(
+            len(reader.failed), len(reader.files)), file=sys.stderr)
+        sys.exit(-1)
+
+
+def run_camera(args, categories, postprocessor, postprocessor_args, sink, metrics):
+    '''Run the demo on a camera as a threaded pipeline, with a window or
+    headless, the results written to the sink if any.
+    '''
+    # Create Triton client, with an input buffer per frame ahead of inference
+    client = triton_client.TritonClient(
+        url=args.url, max_inflight=args.inflight, shared_memory=args.shm,
+        input_pool_size=args.inflight + pipeline.FRAMES_AHEAD
+    )
+
+    # Load model
+    try:
+        client.load_model(model_name=MODEL_NAME, cache=model_cache(args),
+                          server_timeout=args.wait_server)
+        client.warmup(args.warmup)
+    except triton_client.TritonClientError as e:
+        print(e, file=sys.stderr)
+        sys.exit(-1)
+
+    print('Model {} loaded successfully'.format(MODEL_NAME), file=sys.stderr)
+
+    # Initialize camera device
+    cam_id = args.camera
+    cap = cv2.VideoCapture(cam_id)
+    if not cap.isOpened():
+        print("Cannot open camera", file=sys.stderr)
+        sys.exit()
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, args.width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, args.height)
+
+    # Define the stages of the pipeline:
+    # capture -> preprocess -> inference -> postprocess -> render (main thread)
+    def preprocess_frame(item):
+        if args.preprocess == 'opencv':
+            image = client.acquire_input_buffer()
+            if image is None:
+                # All the input buffers are still in use, skip the frame
+                return None
+            item.image = preprocess.preprocess_opencv(
+                item.frame, client.format, client.dtype,
+                client.c, client.h, client.w, out=image
+            )
+        else:
+            item.image = preprocess.preprocess(
+                item.frame, client.format, client.dtype,
+                client.c, client.h, client.w
+            )
+        return item
+
+    def postprocess_frame(item):
+        height, width, _ = item.frame.shape
+        item.result = postprocessor.process([item.output], (width, height))
+        return item
+
+    frame_pipeline = pipeline.Pipeline(cap, metrics=metrics)
+    workers = None
+    if args.workers > 0:
+        # Run preprocessing and postprocessing in worker processes,
+        # each with its own postprocessor
+        workers = process_pool.ProcessPool(
+            args.workers, PostprocessYOLO, postprocessor_args
+        )
+        image_buffer = client.get_input_buffer()
+
+        def submit_preprocess(workers, item):
+            return workers.submit(
+                preprocess_task, item.frame, image_buffer.shape, image_buffer.dtype,
+                (args.preprocess, client.format, client.dtype, client.c, client.h, client.w)
+            )
+
+        def finish_preprocess(item, result, image):
+            item.image = image
+            return item
+
+        def submit_postprocess(workers, item):
+            height, width, _ = item.frame.shape
+            return workers.submit(postprocess_task, item.output, args=(width, height))
+
+        def finish_postprocess(item, result, output):
+            item.result = result
+            return item
+
+        frame_pipeline.add_process_stage(
+            workers, submit_preprocess, finish_preprocess, name='preprocess')
+        frame_pipeline.add_inference_stage(client)
+        frame_pipeline.add_process_stage(
+            workers, submit_postprocess, finish_postprocess, name='postprocess')
+    else:
+        frame_pipeline.add_stage(preprocess_frame, name='preprocess')
+        frame_pipeline.add_inference_stage(client)
+        frame_pipeline.add_stage(postprocess_frame, name='postprocess')
+    frame_pipeline.start()
+    if args.headless:
+        # Ctrl+C stops the capture, the frames in the pipeline are still written
+        signal.signal(signal.SIGINT, lambda signum, frame: frame_pipeline.close())
+
+    # Create interval counter to measure FPS
+    fps_counter = interval_counter.IntervalCounter(10)
+
+    # Define the function to detect window close event
+    was_window_closed = lambda: cv2.getWindowProperty(WINDOW_TITLE, cv2.WND_PROP_VISIBLE) < 1
+
+    try:
+        while True:
+            # Get the freshest frame out of the pipeline with its results
+            item = frame_pipeline.get()
+            if item is None:
+                break
+            frame = item.frame
+
+            # Get interval value
+            interval = fps_counter.measure()
+
+            boxes, classes, scores = item.result
+            if sink is not None:
+                sink.write(detection_record(
+                    item.sequence, item.capture_time, boxes, classes, scores
+                ))
+            if args.headless:
+                # No window, overlay or print, only the structured results
+                continue
+
+            with metrics.span('render'):
+                if boxes is not None:
+                    draw_bboxes(frame, boxes, scores, classes, categories)
+
+                draw_info(frame, interval)
+
+                # Show the frame
+                cv2.imshow(WINDOW_TITLE, frame)
+
+                # Check if ESC pressed
+                key = cv2.waitKey(1)
+            if key == 27:  # ESC
+                break
+            # Check if the window was closed
+            if was_window_closed():
+                break
+    finally:
+        frame_pipeline.stop()
+        if frame_pipeline.error() is not None:
+            print(frame_pipeline.error(), file=sys.stderr)
+        if workers is not None:
+            workers.close()
+        if not args.headless:
+            cv2.destroyAllWindows()
+        cap.release()
 
 
 def main():
@@ -112,12 +454,77 @@ def main():
         help='Capture Height (Default: {})'.format(CAPTURE_HEIGHT_DEFAULT))
     parser.add_argument('--url',
         type=str, default=SERVER_URL_DEFAULT, metavar='SERVER_URL',
-        help='Triton Inference Server URL (Default: {})'.format(SERVER_URL_DEFAULT)
+        help='Triton Inference Server URL, grpc:// for gRPC (Default: {})'.format(SERVER_URL_DEFAULT)
     )
+    parser.add_argument('--preprocess',
+        type=str, default=PREPROCESS_BACKEND_DEFAULT, choices=PREPROCESS_BACKENDS,
+        metavar='BACKEND',
+        help='Preprocessing backend {} (Default: {})'.format(
+            PREPROCESS_BACKENDS, PREPROCESS_BACKEND_DEFAULT))
+    parser.add_argument('--inflight',
+        type=int, default=MAX_INFLIGHT_DEFAULT, metavar='MAX_INFLIGHT',
+        help='Max Inference Requests in Flight (Default: {})'.format(MAX_INFLIGHT_DEFAULT))
+    parser.add_argument('--shm',
+        action='store_true',
+        help='Exchange tensors through system shared memory (Server on the same host only)')
+    parser.add_argument('--sources',
+        type=str, nargs='+', default=None, metavar='SOURCE',
+        help='Camera IDs, video files or stream URLs to run at once, instead of --camera')
+    parser.add_argument('--connections',
+        type=int, default=CONNECTIONS_DEFAULT, metavar='CONNECTIONS',
+        help='Triton connections shared by the sources (Default: {})'.format(CONNECTIONS_DEFAULT))
+    parser.add_argument('--workers',
+        type=int, default=WORKERS_DEFAULT, metavar='WORKERS',
+        help='Worker processes for preprocessing and postprocessing, 0 for threads (Default: {})'.format(WORKERS_DEFAULT))
+    parser.add_argument('--headless',
+        action='store_true',
+        help='No window, overlay or printed detections, write the results as JSON Lines')
+    parser.add_argument('--output',
+        type=str, default=None, metavar='OUTPUT',
+        help='Results as JSON Lines to a file, - for stdout, unix:PATH or tcp:HOST:PORT for a socket (Default: {} in headless mode)'.format(OUTPUT_DEFAULT))
+    parser.add_argument('--rotate',
+        type=int, default=ROTATE_DEFAULT, metavar='BYTES',
+        help='Size from which the results file is rotated, 0 not to rotate (Default: {})'.format(ROTATE_DEFAULT))
+    parser.add_argument('--offline',
+        type=str, nargs='+', default=None, metavar='PATH',
+        help='Video files or image directories to process as fast as possible, instead of --camera')
+    parser.add_argument('--batch',
+        type=int, default=BATCH_SIZE_DEFAULT, metavar='BATCH_SIZE',
+        help='Frames per request of the offline mode, 0 for the max batch size of the model (Default: {})'.format(BATCH_SIZE_DEFAULT))
+    parser.add_argument('--metrics',
+        type=float, default=METRICS_INTERVAL_DEFAULT, metavar='SECONDS',
+        help='Print the latency percentiles of the stages every SECONDS, 0 not to (Default: {})'.format(METRICS_INTERVAL_DEFAULT))
+    parser.add_argument('--metrics-port',
+        type=int, default=METRICS_PORT_DEFAULT, metavar='PORT',
+        help='Serve the latencies of the stages for Prometheus on /metrics, 0 not to (Default: {})'.format(METRICS_PORT_DEFAULT))
+    parser.add_argument('--model-cache',
+        type=str, nargs='?', default=None, const=triton_client.MODEL_CACHE_DIR_DEFAULT, metavar='CACHE_DIR',
+        help='Cache the model signature on disk for faster startups (Default directory: {})'.format(triton_client.MODEL_CACHE_DIR_DEFAULT))
+    parser.add_argument('--wait-server',
+        type=float, default=WAIT_SERVER_DEFAULT, metavar='SECONDS',
+        help='Wait up to SECONDS for the server to be ready, 0 not to wait (Default: {})'.format(WAIT_SERVER_DEFAULT))
+    parser.add_argument('--warmup',
+        type=int, default=WARMUP_DEFAULT, metavar='COUNT',
+        help='Blank requests sent before the first frame (Default: {})'.format(WARMUP_DEFAULT))
     args = parser.parse_args()
 
-    # Create Triton client
-    client = triton_client.TritonClient(url=args.url)
+    # Latency of the stages, recorded only if reported
+    metrics = instrumentation.Instrumentation(
+        enabled=args.metrics > 0 or args.metrics_port > 0)
+    if args.metrics > 0:
+        metrics.start_reporter(args.metrics)
+    if args.metrics_port > 0:
+        metrics.serve(args.metrics_port)
+
+    if (args.headless or args.offline) and args.output is None:
+        args.output = OUTPUT_DEFAULT
+    sink = None
+    if args.output is not None:
+        try:
+            sink = result_sink.open_sink(args.output, max_bytes=args.rotate)
+        except (OSError, ValueError) as e:
+            print('Cannot open {}: {}'.format(args.output, e), file=sys.stderr)
+            sys.exit(-1)
 
     # Download label file
     label_path = os.getcwd()
@@ -127,15 +534,6 @@ def main():
     # Load label categories
     categories = [line.rstrip('\n') for line in open(label_file)]
 
-    # Load model
-    try:
-        client.load_model(model_name=MODEL_NAME)
-    except triton_client.TritonClientError as e:
-        print(e)
-        sys.exit(-1)
-
-    print('Model {} loaded successfully'.format(MODEL_NAME))
-
     postprocessor_args = {
         # YOLO masks (Tiny YOLO v2 has only single scale.)
         "yolo_masks": [(0, 1, 2, 3, 4)],
@@ -151,64 +549,18 @@ def main():
         "num_categories": 20}
     postprocessor = PostprocessYOLO(**postprocessor_args)
 
-    # Initialize camera device
-    cam_id = args.camera
-    cap = cv2.VideoCapture(cam_id)
-    if not cap.isOpened():
-        print("Cannot open camera")
-        sys.exit()
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, args.width)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, args.height)
-
-    # Create interval counter to measure FPS
-    fps_counter = interval_counter.IntervalCounter(10)
-
-    # Define the function to detect window close event
-    was_window_closed = lambda: cv2.getWindowProperty(WINDOW_TITLE, cv2.WND_PROP_VISIBLE) < 1
-
-    while True:
-        # Capture frame n
-        ret, frame = cap.read()
-
-        # Preprocess frame n for model spec
-        target_image = preprocess.preprocess(
-            frame, client.format, client.dtype,
-            client.c, client.h, client.w
-        )
-
-        # Get inference results for frame n-1
-        results = client.get_results()
-
-        # Get interval value
-        interval = fps_counter.measure()
-
-        if results is not None:
-            results = results[np.newaxis]
-            height, width, _ = frame.shape
-            boxes, classes, scores = postprocessor.process(
-                results, (width, height)
-            )
-            if boxes is not None:
-                draw_bboxes(frame, boxes, scores, classes, categories)
-
-        draw_info(frame, interval)
-
-        # Show captured frame n
-        cv2.imshow(WINDOW_TITLE, frame)
-
-        # Check if ESC pressed
-        key = cv2.waitKey(1)
-        if key == 27:  # ESC
-            break
-        # Check if the window was closed
-        if was_window_closed():
-            break
-
-        # Submit inference request for frame n
-        client.infer(target_image)
-
-    cv2.destroyAllWindows()
-    cap.release()
+    try:
+        if args.offline:
+            run_offline(args, postprocessor, sink, metrics)
+        elif args.sources:
+            run_streams(args, categories, postprocessor, sink, metrics)
+        else:
+            run_camera(args, categories, postprocessor, postprocessor_args, sink, metrics)
+    finally:
+        # Write the queued results even on Ctrl+C or an error
+        if sink is not None:
+            sink.close()
+        metrics.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+# MIT License
+#
+# Copyright (c) 2022 MACNICA-CLAVIS-NV
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+
+# Groups up to this size are suppressed with a single IoU matrix, which beats the
+# greedy scan while the matrix is small. Larger groups use the greedy scan, whose
+# cost follows the number of kept boxes rather than the square of the group size.
+IOU_MATRIX_MAX_BOXES = 256
+
+
+def _iou_matrix(boxes):
+    """Return the (N,N) matrix of the IoU between every pair of boxes.
+    The IoU is defined like in the original YOLO sample, with one pixel added to
+    the width and the height of the intersection.
+
+    Keyword arguments:
+    boxes -- a NumPy array with shape (N,4); 4 for x,y,width,height coordinates of the boxes
+    """
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = x1 + boxes[:, 2]
+    y2 = y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    width = np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]) + 1
+    height = np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]) + 1
+    intersection = np.maximum(0.0, width) * np.maximum(0.0, height)
+    union = areas[:, None] + areas[None, :] - intersection
+    return intersection / union
+
+
+def _nms_matrix(boxes, iou_threshold):
+    """Greedy NMS over score-ordered boxes using one IoU matrix.
+    A box is kept if no kept box with a higher score overlaps it. Since each box
+    only depends on the boxes before it, the fixed point of that rule is reached by
+    re-evaluating it for all boxes at once until nothing changes, which in practice
+    takes a handful of iterations.
+
+    Keyword arguments:
+    boxes -- a NumPy array with shape (N,4), sorted by descending score
+    iou_threshold -- boxes overlapping a kept box by more than this are suppressed
+    """
+    overlaps = np.triu(_iou_matrix(boxes) > iou_threshold, k=1)
+    keep = np.ones(len(boxes), dtype=bool)
+    while True:
+        suppressed = np.any(overlaps[keep], axis=0)
+        new_keep = ~suppressed
+        if np.array_equal(new_keep, keep):
+            return np.flatnonzero(keep)
+        keep = new_keep
+
+
+def _nms_greedy(boxes, iou_threshold, top_k):
+    """Greedy NMS over score-ordered boxes, scanning one kept box at a time.
+
+    Keyword arguments:
+    boxes -- a NumPy array with shape (N,4), sorted by descending score
+    iou_threshold -- boxes overlapping a kept box by more than this are suppressed
+    top_k -- stop once this many boxes are kept, or None for no limit
+    """
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = x1 + boxes[:, 2]
+    y2 = y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    ordered = np.arange(len(boxes))
+    keep = list()
+    while ordered.size > 0:
+        i = ordered[0]
+        keep.append(i)
+        if top_k is not None and len(keep) >= top_k:
+            break
+        rest = ordered[1:]
+        width = np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]) + 1
+        height = np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]) + 1
+        intersection = np.maximum(0.0, width) * np.maximum(0.0, height)
+        iou = intersection / (areas[i] + areas[rest] - intersection)
+        ordered = rest[iou <= iou_threshold]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def _nms_group(boxes, iou_threshold, top_k):
+    """Suppress the score-ordered boxes of one group with the faster of the two scans.
+
+    Keyword arguments:
+    boxes -- a NumPy array with shape (N,4), sorted by descending score
+    iou_threshold -- boxes overlapping a kept box by more than this are suppressed
+    top_k -- stop once this many boxes are kept, or None for no limit
+    """
+    if len(boxes) == 1:
+        return np.zeros(1, dtype=np.int64)
+    if len(boxes) <= IOU_MATRIX_MAX_BOXES:
+        keep = _nms_matrix(boxes, iou_threshold)
+        return keep if top_k is None else keep[:top_k]
+    return _nms_greedy(boxes, iou_threshold, top_k)
+
+
+def nms(boxes, scores, categories, iou_threshold, top_k=None):
+    """Apply Non-Maximum Suppression separately to the boxes of each category and
+    return the indexes of the boxes to keep, ordered by descending score.
+
+    Keyword arguments:
+    boxes -- a NumPy array with shape (N,4); 4 for x,y,width,height coordinates of the boxes
+    scores -- a NumPy array with the confidence of each box, with shape N
+    categories -- a NumPy integer array with the category (or any other group, such as
+    frame and category combined) of each box, with shape N, or None to suppress across
+    categories
+    iou_threshold -- boxes overlapping a kept box of the same category by more than
+    this are suppressed, float value between 0 and 1
+    top_k -- maximum number of boxes to keep, or None for no limit
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Rank the boxes by descending score, then bring the ranks of each category
+    # together while keeping them in score order within the category
+    order = np.argsort(-scores, kind='stable')
+    if categories is None:
+        ranks = np.arange(len(order))
+        bounds = [0, len(order)]
+    else:
+        grouped = categories[order]
+        ranks = np.argsort(grouped, kind='stable')
+        grouped = grouped[ranks]
+        bounds = np.concatenate(
+            ([0], np.flatnonzero(grouped[1:] != grouped[:-1]) + 1, [len(order)]))
+
+    sorted_boxes = boxes[order]
+    keep = list()
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        group = ranks[start:end]
+        keep.append(group[_nms_group(sorted_boxes[group], iou_threshold, top_k)])
+
+    # Back to the overall score order across the categories
+    keep = np.sort(np.concatenate(keep))
+    if top_k is not None:
+        keep = keep[:top_k]
+    return order[keep]
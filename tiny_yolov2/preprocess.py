@@ -29,6 +29,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import cv2
 import numpy as np
 from PIL import Image
 import tritonclient.grpc.model_config_pb2 as mc
@@ -83,4 +84,46 @@ def preprocess(img, format, dtype, c, h, w):
     # Channels are in RGB order. Currently model configuration data
     # doesn't provide any information as to other channel orderings
     # (like BGR) so we just assume RGB.
-    return ordered
\ No newline at end of file
+    return ordered
+
+
+def preprocess_opencv(img, format, dtype, c, h, w, out=None):
+    """
+    Pre-process an OpenCV BGR image like preprocess, but with OpenCV and
+    NumPy only. The image is resized while still 8-bit, and the channel
+    reordering, the type conversion and the layout change are done in a
+    single copy into the output buffer. If out is given, it must have the
+    shape and type of the pre-processed image and is filled in place.
+    """
+    src_h, src_w = img.shape[:2]
+    if w < src_w and h < src_h:
+        interpolation = cv2.INTER_AREA
+    else:
+        interpolation = cv2.INTER_LINEAR
+    resized = cv2.resize(img, (w, h), interpolation=interpolation)
+
+    if resized.ndim == 2:
+        resized = resized[:, :, np.newaxis]
+    if c == 1:
+        if resized.shape[2] == 3:
+            resized = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)[:, :, np.newaxis]
+        elif resized.shape[2] == 4:
+            resized = cv2.cvtColor(resized, cv2.COLOR_BGRA2GRAY)[:, :, np.newaxis]
+    else:
+        if resized.shape[2] == 1:
+            resized = np.repeat(resized, 3, axis=2)
+        # BGR(A) to RGB as a view, the copy below does the actual reordering
+        resized = resized[:, :, 2::-1]
+
+    # Swap to CHW if necessary
+    if format == mc.ModelInput.FORMAT_NCHW:
+        ordered = np.transpose(resized, (2, 0, 1))
+    else:
+        ordered = resized
+
+    npdtype = triton_to_np_dtype(dtype)
+    if out is None:
+        out = np.empty(ordered.shape, dtype=npdtype)
+    np.copyto(out, ordered, casting='unsafe')
+
+    return out